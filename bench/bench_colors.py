@@ -0,0 +1,77 @@
+""" Compare float and lookup table color conversions
+
+Runs on CPython (python3 bench/bench_colors.py) and on MicroPython, where
+colors.py has to be copied to the board next to this file. """
+import sys
+import time
+sys.path.append('code')
+sys.path.append('../code')
+import colors
+
+try:
+    ticks_us, ticks_diff = time.ticks_us, time.ticks_diff
+except AttributeError: # CPython
+    ticks_us = lambda: int(time.perf_counter() * 1000000)
+    ticks_diff = lambda a, b: a - b
+
+
+def grid(n):
+    """ n*n*n HSV values covering the whole input range """
+    return [(h / n, s / (n - 1), int(v * 255 / (n - 1)))
+            for h in range(n) for s in range(n) for v in range(1, n)]
+
+
+def timeit(name, f, values):
+    t = ticks_us()
+    for v in values:
+        f(*v)
+    t = ticks_diff(ticks_us(), t)
+    print('%-14s %8.1f us/call' % (name, t / len(values)))
+    return t
+
+
+def accuracy(n=40):
+    """ Max difference between float and LUT versions """
+    dxy = [0.0, 0.0] # all, V >= 32
+    drgb = 0
+    dh = 0.0 # sat > 0.2
+    ds = 0.0
+    for h, s, v in grid(n):
+        a = colors.hsv2xy(h, s, v)
+        b = colors.hsv2xy_lut(h, s, v)
+        d = max(abs(a[0] - b[0]), abs(a[1] - b[1]))
+        dxy[0] = max(dxy[0], d)
+        if v >= 32:
+            dxy[1] = max(dxy[1], d)
+        b = colors.xyb2rgb(a[0], a[1], v)
+        c = colors.xyb2rgb_lut(a[0], a[1], v)
+        drgb = max(drgb, abs(b[0] - c[0]), abs(b[1] - c[1]), abs(b[2] - c[2]))
+        b = colors.xyb2hsv(a[0], a[1], v)
+        c = colors.xyb2hsv_lut(a[0], a[1], v)
+        ds = max(ds, abs(b[1] - c[1]))
+        if b[1] > 0.2:
+            d = abs(b[0] - c[0])
+            dh = max(dh, min(d, 1 - d))
+    print('max error: xy %.4f (V >= 32: %.4f), rgb %d/255, hue %.4f, sat %.4f' %
+          (dxy[0], dxy[1], drgb, dh, ds))
+
+
+def bench(n=8):
+    values = grid(n)
+    xy = [colors.hsv2xy(h, s, v) + (v,) for h, s, v in values]
+    print('%d values' % len(values))
+    a = timeit('hsv2xy', colors.hsv2xy, values)
+    b = timeit('hsv2xy_lut', colors.hsv2xy_lut, values)
+    print('speedup %.1fx' % (a / b))
+    a = timeit('xyb2hsv', colors.xyb2hsv, xy)
+    b = timeit('xyb2hsv_lut', colors.xyb2hsv_lut, xy)
+    print('speedup %.1fx' % (a / b))
+    t = ticks_us()
+    colors.xyb2hsv_batch(xy)
+    t = ticks_diff(ticks_us(), t)
+    print('%-14s %8.1f us/call' % ('xyb2hsv_batch', t / len(xy)))
+
+
+if __name__ == '__main__':
+    bench()
+    accuracy()
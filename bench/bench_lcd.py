@@ -0,0 +1,82 @@
+""" LCD bus cost of drawing the screens
+
+Draws the menus and the dashboard into the simulated controller and prints
+what each frame sent to it. Runs on CPython (python3 bench/bench_lcd.py) and
+on the MicroPython unix port. """
+import sys
+import time
+sys.path.append('code')
+sys.path.append('../code')
+
+try:
+    import uasyncio
+except ImportError: # CPython, modules are without the u prefix
+    import asyncio, json, socket, select, errno, os, binascii, collections
+    for m in (asyncio, json, socket, select, errno, os, binascii, collections):
+        sys.modules['u' + m.__name__] = m
+    time.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time.ticks_diff = lambda a, b: a - b
+    time.ticks_add = lambda a, b: a + b
+
+from lcd_sim import SimDisplay
+from base_menu import BaseMenu
+from lights_menu import ColorMenu
+from dashboard import BS100_dashboard
+from deconz import Light
+
+
+def report(name, display, show=False):
+    display.flush()
+    f = display.frame()
+    print('%-22s %4d cmd %4d data %6d us sleep %7d us bus' %
+          (name, f['commands'], f['data'], f['sleep_us'], f['bus_us']))
+    if show:
+        print(display.text())
+    return f
+
+
+def bench_menu(display):
+    items = {'Light %d' % i: None for i in range(8)}
+    menu = BaseMenu(display, None, items, True)
+    menu.item_toggles = [i % 2 == 0 for i in range(8)]
+    menu.draw()
+    report('BaseMenu.draw', display, True)
+    menu.draw()
+    report('BaseMenu.draw again', display)
+    menu.selected = 1
+    menu.draw()
+    report('BaseMenu.draw next', display)
+
+
+def bench_color(display):
+    l = Light('1', '', {'name': 'Lamp', 'hascolor': False,
+                        'state': {'on': True, 'bri': 128, 'ct': 370, 'colormode': 'ct'}}, None)
+    menu = ColorMenu(l, display, None)
+    menu.draw_base()
+    menu.draw()
+    report('ColorMenu screen', display, True)
+    menu.s['bri'] += 2 * menu.sv['bri'][2] # One more block
+    menu.draw_slider(1, 'bri')
+    report('ColorMenu.draw_slider', display)
+
+
+def bench_dash(display):
+    dash = BS100_dashboard(display, None, None)
+    display.frame()
+    dash.temp = '21.5'
+    dash.calendar = ['10.5. Dentist', '12.5. Birthday', '15.5. Trip']
+    dash.draw_dash()
+    report('draw_dash', display, True)
+    dash.draw_dash()
+    report('draw_dash again', display)
+    dash.temp = '21.6'
+    dash.show_temp()
+    report('show_temp', display)
+
+
+if __name__ == '__main__':
+    for bench in (bench_menu, bench_color, bench_dash):
+        display = SimDisplay()
+        display.autoflush = False # Flushed once per frame like by Display.run
+        bench(display)
+        print()
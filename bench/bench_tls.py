@@ -0,0 +1,77 @@
+""" Compare full and resumed TLS handshakes of requests.wrap_tls
+
+Starts a local TLS server with a throwaway certificate and connects to it
+with and without the session cache. Runs on CPython (python3 bench/bench_tls.py),
+needs openssl to create the certificate. """
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+sys.path.append('code')
+sys.path.append('../code')
+sys.modules['usocket'] = socket
+import requests
+
+
+def certificate(path):
+    cert = os.path.join(path, 'cert.pem')
+    key = os.path.join(path, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                    '-keyout', key, '-out', cert, '-days', '1', '-subj', '/CN=localhost'],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+def serve(listener, ctx):
+    while True:
+        conn, _ = listener.accept()
+        try:
+            with ctx.wrap_socket(conn, server_side=True) as s:
+                s.sendall(b'ok\n')
+        except OSError:
+            pass
+
+
+def connect(port, resume):
+    if not resume:
+        requests._sessions.clear()
+    t = time.perf_counter()
+    s = socket.create_connection(('localhost', port))
+    s = requests.wrap_tls(s, 'localhost')
+    s.recv(16) # Session ticket arrives with the first data
+    t = time.perf_counter() - t
+    reused = s.session_reused
+    requests.save_session('localhost', s)
+    s.close()
+    return t, reused
+
+
+def bench(port, resume, n=50):
+    connect(port, resume) # Warm up, stores a session to resume
+    total = 0
+    reused = 0
+    for _ in range(n):
+        t, r = connect(port, resume)
+        total += t
+        reused += r
+    print('%-8s %7.2f ms/connection, %d/%d resumed' %
+          ('resumed' if resume else 'full', total * 1000 / n, reused, n))
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as path:
+        cert, key = certificate(path)
+        server = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server.load_cert_chain(cert, key)
+        requests.ssl_context = ssl.create_default_context(cafile=cert)
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen(5)
+    threading.Thread(target=serve, args=(listener, server), daemon=True).start()
+    port = listener.getsockname()[1]
+    bench(port, False)
+    bench(port, True)
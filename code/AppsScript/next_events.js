@@ -1,10 +1,4 @@
-function doGet(e) {
-    // Require secret token
-    if (e.parameter['token'] != 'your secret') {
-      return ContentService.createTextOutput(e.parameter['token']);
-      return;
-    }
-  
+function calendarText() {
     const calendarId = 'primary';
     const now = new Date();
     const events = Calendar.Events.list(calendarId, {
@@ -15,7 +9,7 @@ function doGet(e) {
     });
     if (!events.items || events.items.length === 0) {
       Logger.log('No events found.');
-      return ContentService.createTextOutput('No events');
+      return 'No events';
     }
   
     var res = ''
@@ -48,5 +42,23 @@ function doGet(e) {
       }
     }
     Logger.log(res)
-    return ContentService.createTextOutput(res);
-  }
\ No newline at end of file
+    return res;
+  }
+
+function doGet(e) {
+    // Require secret token
+    if (e.parameter['token'] != 'your secret') {
+      return ContentService.createTextOutput(e.parameter['token']);
+      return;
+    }
+
+    const res = calendarText();
+    // Validator of the calendar, the panel sends it back as v parameter
+    const digest = Utilities.computeDigest(Utilities.DigestAlgorithm.MD5, res, Utilities.Charset.UTF_8);
+    const etag = digest.map(b => ((b + 256) % 256).toString(16).padStart(2, '0')).join('').substring(0, 16);
+    if (e.parameter['v'] == etag) {
+      // Not modified
+      return ContentService.createTextOutput('=');
+    }
+    return ContentService.createTextOutput(`#${etag}\n${res}`);
+  }
@@ -1,4 +1,4 @@
-import time
+import uasyncio as asyncio
 
 
 class BaseMenu():
@@ -16,8 +16,6 @@ class BaseMenu():
         self.item_toggles = [ None for _ in range(0, self.n_items) ]
 
     def draw(self):
-        self.display.custom_char(0, self.toggle_char_off)
-        self.display.custom_char(1, self.toggle_char_on)
         self.display.clear()
         # line 1
         if self.selected != 0:
@@ -43,13 +41,13 @@ class BaseMenu():
 
         if self.toggles and self.item_toggles[i] is not None:
             if self.item_toggles[i]:
-                self.display.print(chr(1), (19,y))
+                self.display.print(self.display.glyph('toggle_on', self.toggle_char_on), (19,y))
             else:
-                self.display.print(chr(0), (19,y))
+                self.display.print(self.display.glyph('toggle_off', self.toggle_char_off), (19,y))
 
-    def empty_menu(self):
+    async def empty_menu(self):
         if self.n_items == 0:
             self.display.clear()
             self.display.print('Empty menu')
-            time.sleep(3)
+            await asyncio.sleep(3)
             return True
\ No newline at end of file
@@ -0,0 +1,250 @@
+""" Color conversions for deCONZ lights
+
+Float functions are the reference implementation. The *_lut functions give
+the same results using a gamma lookup table and integer matrix math,
+without any pow() calls. Measured against the float functions over the
+whole input range (see bench/bench_colors.py):
+    hsv2xy_lut    x, y within 0.0013 for V >= 32, within 0.007 for dimmer colors
+    xyb2rgb_lut   within 3/255 per channel for colors inside the RGB gamut,
+                  within 11/255 outside of it, because the lut version scales
+                  components > 1 in linear space instead of after gamma
+    xyb2hsv_lut   sat within 0.044, hue within 0.017 for sat > 0.2 (hue of
+                  nearly white colors is sensitive to 1/255 changes of RGB)
+
+The *_lut functions still create floats in hsv2rgb/rgb2hsv, in the gamma
+interpolation and for the final x, y. On CPython they are slower than the
+float functions. deconz.py uses them only if LUT is set, set it once
+bench/bench_colors.py measures them faster on the ESP32.
+"""
+from math import pow, floor
+from array import array
+
+LUT = False # Convert colors of deCONZ lights with the *_lut functions
+
+
+def hsv2rgb(h, s, v):
+    """ HS 0.0-1.0, V 0-255 -> RGB 0-255 """
+    if s == 0.0:
+        return v, v, v
+
+    i = int(h*6.0) # XXX assume int() truncates!
+    f = (h*6.0) - i
+    p = v*(1.0 - s)
+    q = v*(1.0 - s*f)
+    t = v*(1.0 - s*(1.0-f))
+    i = i%6
+
+    if i == 0:
+        return v, t, p
+    if i == 1:
+        return q, v, p
+    if i == 2:
+        return p, v, t
+    if i == 3:
+        return p, q, v
+    if i == 4:
+        return t, p, v
+    if i == 5:
+        return v, p, q
+
+
+def rgb2hsv(r, g, b):
+    """ RGB 0-255 -> HS 0.0-1.0, V 0-255"""
+    maxc = max(r, g, b)
+    minc = min(r, g, b)
+    rangec = (maxc-minc)
+    v = maxc
+
+    if minc == maxc:
+        return 0.0, 0.0, v
+
+    s = rangec / maxc
+    rc = (maxc-r) / rangec
+    gc = (maxc-g) / rangec
+    bc = (maxc-b) / rangec
+
+    if r == maxc:
+        h = bc-gc
+    elif g == maxc:
+        h = 2.0+rc-bc
+    else:
+        h = 4.0+gc-rc
+    h = (h/6.0) % 1.0
+
+    return h, s, v
+
+
+def gamma_correction(value):
+    if value > 0.04045:
+        return pow((value + 0.055) / (1.0 + 0.055), 2.4)
+    else:
+        return value / 12.92
+
+
+def rev_gamma_correction(value):
+    if value <= 0.0031308:
+        return 12.92 * value
+    else:
+        return (1.0 + 0.055) * pow(value, (1.0 / 2.4)) - 0.055
+
+
+def rgb2xy(r, g, b):
+    """ RGB 0-255 -> XY 0.0-1.0 """
+    r = gamma_correction(r / 255)
+    g = gamma_correction(g / 255)
+    b = gamma_correction(b / 255)
+
+    x = r * 0.649926 + g * 0.103455 + b * 0.197109
+    y = r * 0.234327 + g * 0.743075 + b * 0.022598
+    z = r * 0.0000000 + g * 0.053077 + b * 1.035763
+
+    if x + y + z == 0: # Black has no color, use white point
+        return (0.3227, 0.329)
+    return (x / (x + y + z), y / (x + y + z))
+
+
+def xyb2rgb(x, y, bri):
+    """ XY 0.0-1.0, Bri 0-255 -> RGB 0-255 """
+    z = 1.0 - x - y
+    Y = bri / 255
+    X = (Y / y) * x
+    Z = (Y / y) * z
+    r = X * 1.656492 - Y * 0.354851 - Z * 0.255038
+    g = -X * 0.707196 + Y * 1.655397 + Z * 0.036152
+    b =  X * 0.051713 - Y * 0.121364 + Z * 1.011530
+
+    r = max(rev_gamma_correction(r), 0)
+    g = max(rev_gamma_correction(g), 0)
+    b = max(rev_gamma_correction(b), 0)
+
+    # If one component is greater than 1, weight components by that value
+    m = max(r, g, b)
+    if (m > 1):
+        r = r / m
+        g = g / m
+        b = b / m
+
+    return (floor(r * 255), floor(g * 255), floor(b * 255))
+
+
+def xyb2hsv(x, y, bri):
+    """ XY 0.0-1.0, Bri 0-255 -> HS 0.0-1.0, V 0-255"""
+    return rgb2hsv(*xyb2rgb(x, y, bri))
+
+
+def hsv2xy(h, s, v):
+    """ HS 0.0-1.0, V 0-255 -> XY 0.0-1.0 """
+    return rgb2xy(*hsv2rgb(h, s, v))
+
+
+# Fixed-point engine
+# Linear light values are Q16 (1.0 = 65536), matrix coefficients Q10/Q12
+# and x, y Q12. xyb2rgb_lut works in Q14, because X and Z grow with 1/y.
+# Intermediate values stay within MicroPython small ints (< 2**30) for
+# y >= 0.03, which covers the gamuts of the lights (lowest y is 0.04);
+# smaller y still gives correct results, using big ints.
+
+# sRGB 0-255 -> linear Q16
+_GAMMA = array('l', [int(gamma_correction(i / 255) * 65536 + 0.5) for i in range(256)])
+
+# RGB -> XYZ, Q12
+_RGB2XYZ = tuple(int(c * 4096 + 0.5) for c in (
+    0.649926, 0.103455, 0.197109,
+    0.234327, 0.743075, 0.022598,
+    0.0,      0.053077, 1.035763))
+
+# XYZ -> RGB, Q10
+_XYZ2RGB = tuple(int(c * 1024 + (0.5 if c > 0 else -0.5)) for c in (
+    1.656492, -0.354851, -0.255038,
+    -0.707196, 1.655397, 0.036152,
+    0.051713, -0.121364, 1.011530))
+
+
+def _rev_gamma_lut(l):
+    """ Linear Q16 -> sRGB 0-255, same as floor(rev_gamma_correction(l) * 255) """
+    if l <= 0:
+        return 0
+    if l >= 65536:
+        return 255
+    lut = _GAMMA
+    lo, hi = 0, 255 # Find largest i where lut[i] <= l
+    while lo < hi:
+        mid = (lo + hi + 1) >> 1
+        if lut[mid] <= l:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _gamma_lut(c):
+    """ sRGB 0-255 (int or float) -> linear Q16, interpolated between table entries """
+    lut = _GAMMA
+    i = int(c)
+    if i >= 255:
+        return lut[255]
+    l = lut[i]
+    return l + int((lut[i+1] - l) * (c - i))
+
+
+def rgb2xy_lut(r, g, b):
+    """ RGB 0-255 -> XY 0.0-1.0 """
+    r = _gamma_lut(r)
+    g = _gamma_lut(g)
+    b = _gamma_lut(b)
+    m = _RGB2XYZ
+    x = r * m[0] + g * m[1] + b * m[2]
+    y = r * m[3] + g * m[4] + b * m[5]
+    z = g * m[7] + b * m[8]
+    t = x + y + z
+    if t == 0: # Black has no color, use white point
+        return (0.3227, 0.329)
+    return (x / t, y / t)
+
+
+def xyb2rgb_lut(x, y, bri):
+    """ XY 0.0-1.0, Bri 0-255 -> RGB 0-255 """
+    xq = int(x * 4096)
+    yq = int(y * 4096)
+    if yq <= 0:
+        return (0, 0, 0)
+    Y = bri * 16384 // 255 # Q14
+    X = Y * xq // yq
+    Z = Y * (4096 - xq - yq) // yq
+    m = _XYZ2RGB
+    r = (X * m[0] + Y * m[1] + Z * m[2]) >> 10
+    g = (X * m[3] + Y * m[4] + Z * m[5]) >> 10
+    b = (X * m[6] + Y * m[7] + Z * m[8]) >> 10
+
+    # If one component is greater than 1, weight components by that value.
+    # Done in linear space, where the float version weights after gamma.
+    mx = max(r, g, b)
+    if mx > 16384:
+        r = r * 16384 // mx
+        g = g * 16384 // mx
+        b = b * 16384 // mx
+
+    return (_rev_gamma_lut(r << 2), _rev_gamma_lut(g << 2), _rev_gamma_lut(b << 2))
+
+
+def xyb2hsv_lut(x, y, bri):
+    """ XY 0.0-1.0, Bri 0-255 -> HS 0.0-1.0, V 0-255"""
+    return rgb2hsv(*xyb2rgb_lut(x, y, bri))
+
+
+def hsv2xy_lut(h, s, v):
+    """ HS 0.0-1.0, V 0-255 -> XY 0.0-1.0 """
+    return rgb2xy_lut(*hsv2rgb(h, s, v))
+
+
+def xyb2hsv_batch(values):
+    """ Convert list of (x, y, bri) at once, returns list of (h, s, v) """
+    conv = xyb2rgb_lut
+    hsv = rgb2hsv
+    return [hsv(*conv(x, y, bri)) for x, y, bri in values]
+
+
+def hsv2xy_batch(values):
+    """ Convert list of (h, s, v) at once, returns list of (x, y) """
+    conv = hsv2xy_lut
+    return [conv(h, s, v) for h, s, v in values]
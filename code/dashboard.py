@@ -0,0 +1,199 @@
+import time
+import uos
+import uasyncio as asyncio
+import requests
+from scheduler import Scheduler
+
+CALENDAR_CACHE = 'calendar.txt'
+
+
+class BS100_dashboard():
+    def __init__(self, display, keypad, temp_sensor):
+        self.keypad = keypad
+        self.display = display
+        self.backlight = True
+        self.temp_sensor = temp_sensor
+        self.temp = '----'
+        self.deg_char = bytearray([0x02,0x05,0x02,0x00,0x00,0x00,0x00,0x00]) # degree character
+        self.calendar_url = ''
+        self.calendar = []
+        self.calendar_etag = None # Validator of the shown calendar
+        self.active = False # Dashboard is shown
+        self._dirty = set() # Parts of dashboard to redraw
+        self._render = asyncio.Event()
+        self._fetch = asyncio.Event()
+        self._timers_changed = asyncio.Event()
+
+        self.timers = Scheduler()
+        self.timers.add('time', lambda: self.redraw('time'), 60000, align=True) # Every minute
+        self.timers.add('calendar', self._fetch.set, 7200000) # 2 hours
+        self.timers.add('backlight', self.backlight_off, 30000, repeat=False) # 0.5 minute
+        self.timers.add('temp', self.update_temp, 5000)
+
+    def set_calendar_url(self, settings):
+        self.calendar_url = settings.g('calendar')
+
+    def load_calendar(self):
+        # Calendar saved by the last download, shown until a new one is fetched
+        try:
+            with open(CALENDAR_CACHE) as f:
+                self._set_calendar(f.read())
+        except OSError:
+            pass
+
+    def _set_calendar(self, t):
+        # First line of the calendar response is its validator
+        lines = t.splitlines()
+        if lines and lines[0].startswith('#'):
+            self.calendar_etag = lines.pop(0)[1:]
+        self.calendar = lines
+
+    def get_calendar(self):
+        # Get current calendar data line by line, returns False if it didn't change
+        url = self.calendar_url
+        if self.calendar_etag:
+            url += ('&' if '?' in url else '?') + 'v=' + self.calendar_etag
+        etag = None
+        calendar = []
+        f = None
+        r = requests.get(url)
+        try:
+            if r.status_code != 200:
+                raise ValueError('HTTP %d' % r.status_code)
+            for line in r.iter_lines():
+                line = str(line, 'utf-8')
+                if f is None:
+                    if line == '=': # Not modified
+                        return False
+                    f = open(CALENDAR_CACHE + '.tmp', 'w')
+                    if line.startswith('#'):
+                        etag = line[1:]
+                        f.write(line + '\n')
+                        continue
+                f.write(line + '\n')
+                calendar.append(line)
+        finally:
+            r.close()
+            if f is not None:
+                f.close()
+        if f is None: # Empty response
+            return False
+        try:
+            uos.remove(CALENDAR_CACHE)
+        except OSError:
+            pass
+        uos.rename(CALENDAR_CACHE + '.tmp', CALENDAR_CACHE)
+        self.calendar_etag = etag
+        self.calendar = calendar
+        return True
+
+    def print_calendar(self):
+        # Clear old calendar
+        for i in range(3):
+            self.display.print(' '*20, (0,i))
+        # Show calendar
+        for i, line in enumerate(self.calendar):
+            self.display.print(line, (0,i))
+
+    def show_time(self):
+        # Show time
+        t = time.localtime()
+        h = f' {t[3]}' if len(str(t[3])) == 1 else t[3]
+        m = f'0{t[4]}' if len(str(t[4])) == 1 else t[4]
+        self.display.print(f'{h}:{m}', (15,3))
+
+    def show_temp(self):
+        deg = self.display.glyph('deg', self.deg_char)
+        self.display.print(self.temp + deg + 'C', (0,3))
+
+    def draw_dash(self):
+        # Draw dashboard UI
+        self.backlight_on()
+        self.display.clear()
+        self.print_calendar()
+        self.show_temp()
+        self.show_time()
+        self._dirty.clear()
+        self.active = True
+
+    def hide(self):
+        # Stop drawing the dashboard, display is used by something else
+        self.active = False
+
+    def show(self):
+        # Continue drawing the dashboard, display wasn't changed while hidden
+        self.active = True
+        self._render.set()
+
+    def redraw(self, part):
+        # Mark part of the dashboard to be redrawn by the render task
+        self._dirty.add(part)
+        self._render.set()
+
+    async def render(self):
+        # Task drawing changed parts of the dashboard while it is shown
+        draw = {'time': self.show_time,
+                'calendar': self.print_calendar,
+                'temp': self.show_temp}
+        while True:
+            await self._render.wait()
+            self._render.clear()
+            if not self.active:
+                continue
+            for part in self._dirty:
+                draw[part]()
+            self._dirty.clear()
+
+    async def fetch(self):
+        # Task downloading calendar when the calendar timer passes
+        while True:
+            await self._fetch.wait()
+            self._fetch.clear()
+            try:
+                if self.get_calendar():
+                    self.redraw('calendar')
+            except Exception as e:
+                print('get_calendar', e) # Keep showing the cached calendar
+
+    async def run(self):
+        # Task running timers, sleeps until the nearest one
+        while True:
+            self.timers.run()
+            self._timers_changed.clear()
+            try:
+                await asyncio.wait_for_ms(self._timers_changed.wait(), self.next_timer())
+            except asyncio.TimeoutError:
+                pass
+
+    def next_timer(self):
+        # Milliseconds until the nearest timer passes
+        left = self.timers.next_deadline()
+        return 3600000 if left is None else left
+
+    def add_timer(self, name, callback, period, align=False, repeat=True):
+        # Register a job run by the dashboard every period ms
+        self.timers.add(name, callback, period, align, repeat)
+        self._timers_changed.set()
+
+    def busy(self):
+        # Dashboard has something to draw or fetch
+        return self._render.is_set() or self._fetch.is_set()
+
+    def backlight_on(self):
+        # Turn on backlight
+        self.timers.reset('backlight')
+        self._timers_changed.set()
+        if self.backlight == False:
+            self.backlight = True
+            self.display.backlight_on()
+            self.keypad.backlight_on()
+
+    def backlight_off(self):
+        # Turn off backlight, runs when the backlight timer passes
+        self.backlight = False
+        self.display.backlight_off()
+        self.keypad.backlight_off()
+
+    def update_temp(self):
+        self.temp = self.temp_sensor.read()
+        self.redraw('temp')
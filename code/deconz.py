@@ -1,149 +1,155 @@
 import ujson
 import usocket
-from math import pow, floor
-
-
-def hsv2rgb(h, s, v):
-    """ HS 0.0-1.0, V 0-255 -> RGB 0-255 """
-    if s == 0.0:
-        return v, v, v
-
-    i = int(h*6.0) # XXX assume int() truncates!
-    f = (h*6.0) - i
-    p = v*(1.0 - s)
-    q = v*(1.0 - s*f)
-    t = v*(1.0 - s*(1.0-f))
-    i = i%6
-
-    if i == 0:
-        return v, t, p
-    if i == 1:
-        return q, v, p
-    if i == 2:
-        return p, v, t
-    if i == 3:
-        return p, q, v
-    if i == 4:
-        return t, p, v
-    if i == 5:
-        return v, p, q
-
-
-def rgb2hsv(r, g, b):
-    """ RGB 0-255 -> HS 0.0-1.0, V 0-255"""
-    maxc = max(r, g, b)
-    minc = min(r, g, b)
-    rangec = (maxc-minc)
-    v = maxc
-
-    if minc == maxc:
-        return 0.0, 0.0, v
-
-    s = rangec / maxc
-    rc = (maxc-r) / rangec
-    gc = (maxc-g) / rangec
-    bc = (maxc-b) / rangec
-
-    if r == maxc:
-        h = bc-gc
-    elif g == maxc:
-        h = 2.0+rc-bc
-    else:
-        h = 4.0+gc-rc
-    h = (h/6.0) % 1.0
-
-    return h, s, v
-
-
-def gamma_correction(value):
-    if value > 0.04045:
-        return pow((value + 0.055) / (1.0 + 0.055), 2.4)
-    else:
-        return value / 12.92
-
-
-def rev_gamma_correction(value):
-    if value <= 0.0031308:
-        return 12.92 * value
-    else:
-        return (1.0 + 0.055) * pow(value, (1.0 / 2.4)) - 0.055
-
-
-def rgb2xy(r, g, b):
-    """ RGB 0-255 -> XY 0.0-1.0 """
-    r = gamma_correction(r / 255)
-    g = gamma_correction(g / 255)
-    b = gamma_correction(b / 255)
-
-    x = r * 0.649926 + g * 0.103455 + b * 0.197109
-    y = r * 0.234327 + g * 0.743075 + b * 0.022598
-    z = r * 0.0000000 + g * 0.053077 + b * 1.035763
-
-    return (x / (x + y + z), y / (x + y + z))
-
-
-def xyb2rgb(x, y, bri):
-    """ XY 0.0-1.0, Bri 0-255 -> RGB 0-255 """
-    z = 1.0 - x - y
-    Y = bri / 255
-    X = (Y / y) * x
-    Z = (Y / y) * z
-    r = X * 1.656492 - Y * 0.354851 - Z * 0.255038
-    g = -X * 0.707196 + Y * 1.655397 + Z * 0.036152
-    b =  X * 0.051713 - Y * 0.121364 + Z * 1.011530
-
-    r = max(rev_gamma_correction(r), 0)
-    g = max(rev_gamma_correction(g), 0)
-    b = max(rev_gamma_correction(b), 0)
-
-    # If one component is greater than 1, weight components by that value
-    m = max(r, g, b)
-    if (m > 1):
-        r = r / m
-        g = g / m
-        b = b / m
-
-    return (floor(r * 255), floor(g * 255), floor(b * 255))
-
-
-def xyb2hsv(x, y, bri):
-    """ XY 0.0-1.0, Bri 0-255 -> HS 0.0-1.0, V 0-255"""
-    return rgb2hsv(*xyb2rgb(x, y, bri))
-
+import uasyncio as asyncio
+import uselect
+import uerrno
+import uos
+import ubinascii
+import time
+import jsonstream
+import colors
+if colors.LUT:
+    from colors import hsv2xy_lut as hsv2xy, xyb2hsv_lut as xyb2hsv
+else:
+    from colors import hsv2xy, xyb2hsv
+
+
+def remote_state(state):
+    """ Convert local light state (as stored in presets) to deCONZ light state """
+    mode = state.get('mode')
+    if mode == 'color':
+        return {'on': state['on'],
+                'xy': hsv2xy(state['hue'], state['sat'], state['bri']),
+                'bri': state['bri']}
+    if mode == 'ctemp':
+        return {'on': state['on'], 'ct': state['ct'], 'bri': state['bri']}
+    return {'on': state['on']}
+
+
+# Fields of /lights response used by Light, everything else is dropped while parsing
+LIGHT_FIELDS = {'name': True, 'hascolor': True, 'etag': True,
+                'state': {'on': True, 'bri': True, 'ct': True, 'hue': True,
+                          'sat': True, 'xy': True, 'colormode': True}}
+
+
+def _id_key(id):
+    """ Sort key for deconz ids, numeric ids are sorted by value """
+    return (0, int(id), '') if id.isdigit() else (1, 0, id)
+
+
+class Pool():
+    """ Keep-alive connections to deCONZ with cached DNS lookups """
+
+    def __init__(self, dns_ttl=300, max_idle=4):
+        self.dns_ttl = dns_ttl
+        self.max_idle = max_idle
+        self._dns = {} # (host, port): (addrinfo, expiration time)
+        self._idle = {} # host: [idle sockets]
+
+    def resolve(self, host, port=80):
+        """ Return cached address info for host and port, resolve it again after TTL """
+        ai, exp = self._dns.get((host, port), (None, 0))
+        if ai is None or time.time() > exp:
+            ai = usocket.getaddrinfo(host, port, 0, usocket.SOCK_STREAM)[0]
+            self._dns[(host, port)] = (ai, time.time() + self.dns_ttl)
+        return ai
+
+    def connect(self, host, blocking=True, port=80):
+        """ Open new connection to host
+
+        Non-blocking connection is returned while still connecting. """
+        ai = self.resolve(host, port)
+        s = usocket.socket(ai[0], usocket.SOCK_STREAM, ai[2])
+        if blocking:
+            s.settimeout(2.0)
+        else:
+            s.setblocking(False)
+        try:
+            s.connect(ai[-1])
+        except OSError as e:
+            if not blocking and e.errno == uerrno.EINPROGRESS:
+                return s
+            s.close()
+            del self._dns[(host, port)] # Address may have changed
+            raise
+        return s
+
+    def take_idle(self, host):
+        """ Return idle connection to host or None """
+        idle = self._idle.get(host)
+        if idle:
+            return idle.pop()
+
+    def acquire(self, host):
+        """ Return (socket, reused), idle connection is used if there is one """
+        s = self.take_idle(host)
+        if s is not None:
+            return s, True
+        return self.connect(host), False
+
+    def release(self, host, s):
+        """ Return connection to the pool for reuse """
+        s.settimeout(2.0)
+        idle = self._idle.setdefault(host, [])
+        if len(idle) < self.max_idle:
+            idle.append(s)
+        else:
+            s.close()
 
-def hsv2xy(h, s, v):
-    """ HS 0.0-1.0, V 0-255 -> XY 0.0-1.0 """
-    return rgb2xy(*hsv2rgb(h, s, v))
+    def close(self):
+        """ Close all idle connections """
+        for idle in self._idle.values():
+            for s in idle:
+                s.close()
+        self._idle = {}
 
 
 class REST():
     """ Cut down urequests for the purposes of interacting with lights using deCONZ REST API """
 
-    def __init__(self, method, url, data=None):
+    def __init__(self, method, url, data=None, pool=None, stream=False):
         self.data = data
         self.method = method
+        self.stream = stream
+        self.body = None
+        self.pool = pool if pool is not None else Pool()
         self.s = None
-        port = 80
+        self.keep_alive = False
 
         _, _, self.host, self.path = url.split("/", 3)
 
-        ai = usocket.getaddrinfo(self.host, port, 0, usocket.SOCK_STREAM)
-        self.ai = ai[0]
-
     def __enter__(self):
-        self.s = usocket.socket(self.ai[0], usocket.SOCK_STREAM, self.ai[2])
-        self.s.settimeout(2.0)
-        self.s.connect(self.ai[-1])
+        if self.data:
+            self.data = ujson.dumps(self.data)
+
+        s, reused = self.pool.acquire(self.host)
+        try:
+            return self._request(s)
+        except OSError:
+            if not reused:
+                raise
+        # Idle connection was closed by the server, retry with a new one
+        return self._request(self.pool.connect(self.host))
+
+    def _request(self, s):
+        """ Send request over s and read the response, s is closed if that fails """
+        self.s = s
+        try:
+            return self._exchange()
+        except Exception:
+            s.close()
+            self.s = None
+            raise
 
+    def _exchange(self):
         # Send headers
-        self.s.write(b"%s /%s HTTP/1.0\r\n" % (self.method, self.path))
+        self.s.write(b"%s /%s HTTP/1.1\r\n" % (self.method, self.path))
         self.s.write(b"Host: %s\r\n" % self.host)
 
         if self.data:
-            self.data = ujson.dumps(self.data)
             self.s.write(b"Content-Type: application/json\r\n")
             self.s.write(b"Content-Length: %d\r\n" % len(self.data))
-        self.s.write(b"Connection: close\r\n\r\n")
+        self.s.write(b"Connection: keep-alive\r\n\r\n")
 
         # Send data
         if self.data:
@@ -151,48 +157,544 @@ class REST():
 
         # Read response headers
         l = self.s.readline()
+        if not l:
+            raise OSError("Connection closed")
         l = l.split(None, 2)
         if len(l) < 2:
             # Invalid response
             raise ValueError("HTTP error: BadStatusLine:\n%s" % l)
         status = int(l[1])
+        length = None
+        chunked = False
+        keep_alive = l[0] == b"HTTP/1.1"
         while True:
             l = self.s.readline()
             if not l or l == b"\r\n":
                 break
-            if l.startswith(b"Transfer-Encoding:"):
-                if b"chunked" in l:
-                    raise ValueError("Unsupported " + str(l, "utf-8"))
+            h = l.lower()
+            if h.startswith(b"content-length:"):
+                length = int(l[15:])
+            elif h.startswith(b"transfer-encoding:"):
+                chunked = b"chunked" in h
+            elif h.startswith(b"connection:"):
+                keep_alive = b"close" not in h
+
+        # Return body reader instead of parsed data
+        if self.stream:
+            self.body = _Body(self.s, length, chunked)
+            self.keep_alive = keep_alive and (chunked or length is not None)
+            return (status, self.body)
 
         # Read response data
-        d = bytes()
-        try:
-            while True:
-                d += self.s.read(1)
-        except OSError as e:
-            if e.errno != 116: # ETIMEDOUT
-                raise
-        d = ujson.loads(d)
+        if chunked:
+            d = self._read_chunked()
+        elif length is not None:
+            d = self._read_exact(length)
+        else:
+            d = self.s.read() # No length given, server closes the connection
+            keep_alive = False
+        self.keep_alive = keep_alive
+        d = ujson.loads(d) if d else None
 
         return (status, d)
 
+    def _read_exact(self, n):
+        """ Read exactly n bytes of body into a preallocated buffer """
+        buf = bytearray(n)
+        mv = memoryview(buf)
+        pos = 0
+        while pos < n:
+            r = self.s.readinto(mv[pos:])
+            if not r:
+                raise OSError("Connection closed")
+            pos += r
+        return buf
+
+    def _read_chunked(self):
+        """ Read chunked body, returns after the terminating zero size chunk """
+        d = bytearray()
+        while True:
+            size = int(self.s.readline().split(b";")[0], 16)
+            if size == 0:
+                break
+            d += self._read_exact(size)
+            self.s.readline() # CRLF after chunk data
+        # Skip trailers
+        while True:
+            l = self.s.readline()
+            if not l or l == b"\r\n":
+                break
+        return d
+
     def __exit__(self, type, value, traceback):
+        if self.s is None:
+            return
+        if self.keep_alive and type is None and (self.body is None or self.body.drain()):
+            self.pool.release(self.host, self.s)
+        else:
+            self.s.close()
+
+
+class _Body():
+    """ Stream of response body, stops at the end of the body so the connection can be reused """
+
+    def __init__(self, s, length, chunked):
+        self.s = s
+        self.chunked = chunked
+        self.left = 0 if chunked else length # Bytes left in body or current chunk
+        self.done = length == 0
+
+    def readinto(self, buf):
+        """ Read body data into buf, returns 0 at the end of the body """
+        if self.done:
+            return 0
+        if self.left is None: # Unknown length, read until connection is closed
+            n = self.s.readinto(buf)
+            self.done = not n
+            return n
+        if self.left == 0: # Start of next chunk
+            l = self.s.readline()
+            if l == b"\r\n": # CRLF after previous chunk data
+                l = self.s.readline()
+            self.left = int(l.split(b";")[0], 16)
+            if self.left == 0:
+                # Skip trailers
+                while True:
+                    l = self.s.readline()
+                    if not l or l == b"\r\n":
+                        break
+                self.done = True
+                return 0
+        n = self.s.readinto(buf[:min(len(buf), self.left)])
+        if not n:
+            raise OSError("Connection closed")
+        self.left -= n
+        if self.left == 0 and not self.chunked:
+            self.done = True
+        return n
+
+    def drain(self):
+        """ Read rest of the body, returns True if whole body was read """
+        buf = bytearray(64)
+        while not self.done:
+            if self.left is None:
+                return False
+            self.readinto(buf)
+        return True
+
+
+class _Job():
+    """ Single request sent by FanOut """
+
+    def __init__(self, key, method, url, data):
+        self.key = key
+        _, _, self.host, path = url.split("/", 3)
+        body = ujson.dumps(data).encode() if data else b''
+        self.req = (b"%s /%s HTTP/1.1\r\nHost: %s\r\n" % (method, path, self.host) +
+                    b"Content-Type: application/json\r\nContent-Length: %d\r\n" % len(body) +
+                    b"Connection: keep-alive\r\n\r\n" + body)
+        self.s = None
+        self.reused = False
+        self.reset()
+
+    def reset(self):
+        self.sent = 0
+        self.rx = bytearray()
+        self.status = None
+        self.keep_alive = False
+        self.pos = 0 # Start of the body, then of the next chunk
+        self.length = None # Body length from Content-Length
+        self.chunked = False
+        self.body = bytearray() # Chunks received so far
+
+    def response(self, closed=False):
+        """ Return (status, data) if the whole response was received
+
+        closed: the server closed the connection, ends a body without length """
+        rx = self.rx
+        if self.status is None:
+            end = rx.find(b"\r\n\r\n")
+            if end < 0:
+                return None
+            head = bytes(rx[:end]).lower().split(b"\r\n")
+            self.status = int(head[0].split()[1])
+            self.keep_alive = head[0].startswith(b"http/1.1")
+            self.pos = end + 4
+            for h in head[1:]:
+                if h.startswith(b"content-length:"):
+                    self.length = int(h[15:])
+                elif h.startswith(b"transfer-encoding:"):
+                    self.chunked = b"chunked" in h
+                elif h.startswith(b"connection:"):
+                    self.keep_alive = b"close" not in h
+        if self.chunked:
+            body = self._chunks()
+        elif self.length is not None:
+            end = self.pos + self.length
+            body = rx[self.pos:end] if len(rx) >= end else None
+        elif closed: # No length given, body ends with the connection
+            self.keep_alive = False
+            body = rx[self.pos:]
+        else:
+            body = None
+        if body is None:
+            return None
+        return self.status, ujson.loads(body) if body else None
+
+    def _chunks(self):
+        """ Collect complete chunks, return the body once the last chunk and trailers arrived """
+        rx = self.rx
+        while True:
+            end = rx.find(b"\r\n", self.pos)
+            if end < 0:
+                return None
+            size = int(bytes(rx[self.pos:end]).split(b";")[0], 16)
+            if size == 0:
+                # Trailers, if any, end with an empty line
+                return self.body if rx.find(b"\r\n\r\n", end) >= 0 else None
+            if len(rx) < end + size + 4: # Chunk data and its CRLF
+                return None
+            self.body += rx[end + 2:end + 2 + size]
+            self.pos = end + size + 4
+
+
+class FanOut():
+    """ Keeps up to max_inflight requests to deCONZ in flight at once
+
+    Uses non-blocking connections from the pool, results are collected per key. """
+
+    def __init__(self, pool, max_inflight=4, timeout=5000):
+        self.pool = pool
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self.jobs = []
+
+    def add(self, key, method, url, data=None):
+        self.jobs.append(_Job(key, method, url, data))
+
+    def _start(self, job, retry=False):
+        job.s = None if retry else self.pool.take_idle(job.host)
+        job.reused = job.s is not None
+        if job.reused:
+            job.s.setblocking(False)
+        else:
+            job.s = self.pool.connect(job.host, False)
+        job.reset()
+
+    async def arun(self, progress=None):
+        """ Send all requests, returns {key: (status, data)}, status is None on failure
+
+        Other tasks run while waiting for responses.
+        progress: callable(done, total) called after every finished request """
+        self._begin(progress)
+        while self._step():
+            await asyncio.sleep_ms(5)
+        return self._end()
+
+    def _begin(self, progress):
+        self.results = {}
+        self.queue = list(reversed(self.jobs))
+        self.total = len(self.queue)
+        self.active = []
+        self.progress = progress
+        self.poller = uselect.poll()
+        self.deadline = time.ticks_add(time.ticks_ms(), self.timeout)
+
+    def _finish(self, job, res):
+        """ Store result of the job """
+        self.results[job.key] = res
+        if self.progress:
+            self.progress(len(self.results), self.total)
+
+    def _step(self):
+        """ Start queued requests and handle ready connections, returns False when done """
+        queue, active, poller = self.queue, self.active, self.poller
+        # Keep the pipeline full
+        while queue and len(active) < self.max_inflight:
+            job = queue.pop()
+            try:
+                self._start(job)
+            except OSError as e:
+                print('fanout', job.key, e)
+                self._finish(job, (None, None))
+                continue
+            active.append(job)
+            poller.register(job.s, uselect.POLLOUT)
+
+        if not active or time.ticks_diff(self.deadline, time.ticks_ms()) <= 0:
+            return False
+        for ev in poller.poll(0):
+            job = None
+            for j in active:
+                if j.s is ev[0]:
+                    job = j
+            if job is None:
+                continue
+            try:
+                if ev[1] & (uselect.POLLERR | uselect.POLLHUP) and job.sent < len(job.req):
+                    raise OSError("Connection failed")
+                if job.sent < len(job.req):
+                    try:
+                        job.sent += job.s.send(job.req[job.sent:])
+                    except OSError as e:
+                        if e.errno != uerrno.EAGAIN:
+                            raise
+                    if job.sent == len(job.req):
+                        poller.modify(job.s, uselect.POLLIN)
+                    continue
+                d = job.s.recv(512)
+                job.rx += d
+                res = job.response(not d)
+                if res is None:
+                    if not d:
+                        raise OSError("Connection closed")
+                    continue
+                active.remove(job)
+                poller.unregister(job.s)
+                if job.keep_alive:
+                    self.pool.release(job.host, job.s)
+                else:
+                    job.s.close()
+                self._finish(job, res)
+            except (OSError, ValueError) as e:
+                poller.unregister(job.s)
+                job.s.close()
+                if job.reused and not job.rx:
+                    # Stale idle connection, retry with a new one
+                    try:
+                        self._start(job, True)
+                        poller.register(job.s, uselect.POLLOUT)
+                        continue
+                    except OSError:
+                        pass
+                active.remove(job)
+                print('fanout', job.key, e)
+                self._finish(job, (None, None))
+        return True
+
+    def _end(self):
+        # Timed out
+        for job in self.active:
+            job.s.close()
+            self.results[job.key] = (None, None)
+        self.jobs = []
+        self.active = []
+        self.poller = None
+        return self.results
+
+
+class Events():
+    """ Minimal WebSocket client receiving deCONZ event stream """
+
+    def __init__(self, pool, host, port):
+        self.pool = pool
+        self.host = host
+        self.port = port
+        self.s = None
+        self.rx = bytearray()
+
+    @property
+    def connected(self):
+        return self.s is not None
+
+    def connect(self):
+        """ Open WebSocket connection, returns True on success """
+        ai = self.pool.resolve(self.host, self.port)
+        s = usocket.socket(ai[0], usocket.SOCK_STREAM, ai[2])
+        s.settimeout(2.0)
+        try:
+            s.connect(ai[-1])
+            key = ubinascii.b2a_base64(uos.urandom(16))[:-1]
+            s.write(b"GET / HTTP/1.1\r\nHost: %s:%d\r\n" % (self.host, self.port))
+            s.write(b"Upgrade: websocket\r\nConnection: Upgrade\r\n")
+            s.write(b"Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n" % key)
+            l = s.readline().split(None, 2)
+            if len(l) < 2 or l[1] != b"101":
+                raise OSError("Upgrade failed %s" % l)
+            while True:
+                l = s.readline()
+                if not l or l == b"\r\n":
+                    break
+        except OSError as e:
+            print('events', e)
+            s.close()
+            return False
+        s.setblocking(False)
+        self.s = s
+        self.rx = bytearray()
+        return True
+
+    def close(self):
         if self.s is not None:
             self.s.close()
+        self.s = None
+
+    def _send(self, opcode, payload=b''):
+        """ Send masked control frame, payload has to be shorter than 126 bytes """
+        mask = uos.urandom(4)
+        frame = bytearray((0x80 | opcode, 0x80 | len(payload)))
+        frame += mask
+        frame += bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+        self.s.setblocking(True)
+        self.s.write(frame)
+        self.s.setblocking(False)
+
+    def _frame(self):
+        """ Return (opcode, payload) of the first complete frame in the buffer """
+        rx = self.rx
+        if len(rx) < 2:
+            return None
+        n = rx[1] & 0x7f
+        pos = 2
+        if n == 126:
+            if len(rx) < 4:
+                return None
+            n = (rx[2] << 8) | rx[3]
+            pos = 4
+        elif n == 127:
+            if len(rx) < 10:
+                return None
+            n = int.from_bytes(rx[2:10], 'big')
+            pos = 10
+        if len(rx) < pos + n:
+            return None
+        frame = (rx[0] & 0x0f, bytes(rx[pos:pos+n]))
+        self.rx = rx[pos+n:]
+        return frame
+
+    def read(self):
+        """ Return list of received events without blocking """
+        events = []
+        if self.s is None:
+            return events
+        try:
+            while True:
+                d = self.s.recv(512)
+                if not d:
+                    raise OSError("Connection closed")
+                self.rx += d
+        except OSError as e:
+            if e.errno != uerrno.EAGAIN:
+                print('events', e)
+                self.close()
+                return events
+
+        while True:
+            f = self._frame()
+            if f is None:
+                break
+            opcode, payload = f
+            if opcode == 0x1: # Text
+                try:
+                    events.append(ujson.loads(payload))
+                except ValueError:
+                    pass
+            elif opcode == 0x9: # Ping
+                self._send(0xA, payload)
+            elif opcode == 0x8: # Close
+                self.close()
+                break
+        return events
+
+
+class LightState():
+    """ Local light state packed into 8 bytes, with dict-like access
+
+    Layout: flags, bri, ct (2 B), hue (2 B), sat (2 B)
+    flags: bit 0 on, bits 1-2 mode, bits 3-6 ct/bri/hue/sat is set
+    Hue and sat 0.0-1.0 are stored in thousandths. """
+    __slots__ = ('b',)
+    MODES = (None, 'color', 'ctemp')
+    # name: (offset, size, flag of value being set, scale)
+    FIELDS = {'bri': (1, 1, 0x10, 1),
+              'ct': (2, 2, 0x08, 1),
+              'hue': (4, 2, 0x20, 1000),
+              'sat': (6, 2, 0x40, 1000)}
+    KEYS = ('on', 'ct', 'bri', 'hue', 'sat', 'mode')
+
+    def __init__(self, b=None):
+        self.b = bytearray(b) if b else bytearray(8)
+
+    def __getitem__(self, k):
+        b = self.b
+        if k == 'on':
+            return bool(b[0] & 0x01)
+        if k == 'mode':
+            return self.MODES[(b[0] >> 1) & 0x03]
+        o, n, f, scale = self.FIELDS[k]
+        if not b[0] & f:
+            return None
+        v = b[o] if n == 1 else (b[o] << 8) | b[o+1]
+        return v / scale if scale != 1 else v
+
+    def __setitem__(self, k, v):
+        b = self.b
+        if k == 'on':
+            b[0] = (b[0] | 0x01) if v else (b[0] & ~0x01)
+            return
+        if k == 'mode':
+            b[0] = (b[0] & ~0x06) | (self.MODES.index(v) << 1)
+            return
+        o, n, f, scale = self.FIELDS[k]
+        if v is None:
+            b[0] &= ~f
+            return
+        b[0] |= f
+        v = int(round(v * scale)) if scale != 1 else int(v)
+        # Saturate, a byte would raise or wrap around
+        v = min(max(v, 0), 0xff if n == 1 else 0xffff)
+        if n == 1:
+            b[o] = v
+        else:
+            b[o], b[o+1] = v >> 8, v & 0xff
+
+    def __contains__(self, k):
+        return k in self.KEYS and (k != 'mode' or self['mode'] is not None)
+
+    def __eq__(self, other):
+        return isinstance(other, LightState) and self.b == other.b
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def get(self, k, default=None):
+        return self[k] if k in self else default
+
+    def copy(self):
+        return LightState(self.b)
+
+    def to_dict(self):
+        """ Return state as dict, used to store the state in presets """
+        d = {k: self[k] for k in self.KEYS[:5]}
+        if self['mode']:
+            d['mode'] = self['mode']
+        return d
 
 
 class Light():
-    def __init__(self, id, url, d):
+    __slots__ = ('id', 'pool', 'base', 'state', 'etag', 'name', 'color')
+
+    def __init__(self, id, url, d, pool):
         self.id = id
-        self.url = f'{url}/{id}'
+        self.pool = pool
+        self.base = url # Lights url shared by all lights
+        self.state = LightState() # Not the same as light state in deconz
+        self.update(d)
+
+    @property
+    def url(self):
+        return f'{self.base}/{self.id}'
+
+    def update(self, d):
+        """ Update light from deconz light data """
+        self.etag = d.get('etag')
         self.name = d['name']
         self.color = d['hascolor']
-        self.state = {} # Not the same as light state in deconz
         self._update_local_state(d['state'])
 
     def _set_remote_state(self, d):
         """ Sends new state to deconz light and calls get_state to update local state """
-        with REST('PUT', f'{self.url}/state', d) as r:
+        with REST('PUT', f'{self.url}/state', d, self.pool) as r:
             if r[0] == 200:
                 # TODO: There is an issue where some lights report
                 # wildly different values than what they were set to, so
@@ -207,7 +709,7 @@ class Light():
     def get_state(self):
         """ Update state of light from deconz """
         try:
-            with REST('GET', self.url) as response:
+            with REST('GET', self.url, pool=self.pool) as response:
                 self._update_local_state(response[1]['state'])
             return True
         except Exception as e:
@@ -215,23 +717,40 @@ class Light():
             return False
 
     def on(self):
-        self._update_state(on=True)
-        return self._set_remote_state({'on': True})
+        return self._set_remote_state(self.on_state())
 
     def off(self):
-        self._update_state(on=False)
-        return self._set_remote_state({'on': False})
+        return self._set_remote_state(self.off_state())
 
     def set_ctemp(self, on, ct, b):
-        self._update_state(on=on, ct=ct, bri=b, mode='ctemp')
-        return self._set_remote_state({'on': on, 'ct': ct, 'bri': b})
+        return self._set_remote_state(self.ctemp_state(on, ct, b))
 
     def set_color(self, on, h, s, b):
+        return self._set_remote_state(self.color_state(on, h, s, b))
+
+    # *_state methods update local state and return the remote state to send,
+    # so several lights can be set at once with Deconz.set_states
+    def on_state(self):
+        self._update_state(on=True)
+        return {'on': True}
+
+    def off_state(self):
+        self._update_state(on=False)
+        return {'on': False}
+
+    def ctemp_state(self, on, ct, b):
+        self._update_state(on=on, ct=ct, bri=b, mode='ctemp')
+        return {'on': on, 'ct': ct, 'bri': b}
+
+    def color_state(self, on, h, s, b):
         xy = hsv2xy(h, s, b)
         self._update_state(on=on, bri=b, hue=h, sat=s, mode='color')
-        return self._set_remote_state({'on': on, 'xy': xy, 'bri': b})
+        return {'on': on, 'xy': xy, 'bri': b}
 
     def _update_state(self, on=None, ct=None, bri=None, hue=None, sat=None, mode=None):
+        # Local state now runs ahead of deconz, if the PUT fails the etag
+        # stays the same, so make the next get_lights merge the light again
+        self.etag = None
         if on is not None:
             self.state['on'] = on
         if ct is not None:
@@ -245,6 +764,21 @@ class Light():
         if mode:
             self.state['mode'] = mode
 
+    def _merge_remote_state(self, state):
+        """ Updates local light state from partial remote state data (events) """
+        bri = state.get('bri', self.state.get('bri'))
+        if 'hue' in state and 'sat' in state:
+            self.state['hue'], self.state['sat'] = state['hue']/65535, state['sat']/255
+        elif 'xy' in state and bri is not None:
+            self.state['hue'], self.state['sat'], _ = xyb2hsv(state['xy'][0], state['xy'][1], bri)
+        for k in ('on', 'ct', 'bri'):
+            if k in state:
+                self.state[k] = state[k]
+        if state.get('colormode') in ['hs', 'xy']:
+            self.state['mode'] = 'color'
+        if state.get('colormode') == 'ct':
+            self.state['mode'] = 'ctemp'
+
     def _update_local_state(self, state):
         """ Updates local light state from remote state data """
         if 'hue' in state:
@@ -253,45 +787,225 @@ class Light():
             h, s, v = xyb2hsv(state['xy'][0], state['xy'][1], state['bri'])
         else:
             h, s, v = None, None, None
-        self.state = {'on': state['on'],
-                      'ct': state.get('ct'),
-                      'bri': state.get('bri'),
-                      'hue': h,
-                      'sat': s}
+        st = LightState()
+        st['on'] = state['on']
+        st['ct'] = state.get('ct')
+        st['bri'] = state.get('bri')
+        st['hue'] = h
+        st['sat'] = s
         if state.get('colormode') in ['hs', 'xy']:
-            self.state['mode'] = 'color'
+            st['mode'] = 'color'
         if state.get('colormode') == 'ct':
-            self.state['mode'] = 'ctemp'
+            st['mode'] = 'ctemp'
+        self.state = st
 
 
 class Deconz():
-    def __init__(self):
+    def __init__(self, connect=True):
         self._url = 'http://homeassistant.lan/api'
         self._user = '3CB8819D1B'
-        self.url = f'{self._url}/{self._user}/lights'
-        self.lights = []
+        self.api = f'{self._url}/{self._user}'
+        self.url = f'{self.api}/lights'
+        self.lights = [] # Lights in stable order for menus
+        self._index = {} # id: Light
+        self.pool = Pool()
+        self.events = None
+        self._events_retry = 0
+        if connect:
+            self.connect()
+
+    def connect(self):
+        """ Download lights and start receiving their changes """
         self.get_lights()
+        self.start_events()
+
+    def start_events(self):
+        """ Connect to deCONZ WebSocket to receive light changes """
+        status, cfg = self._request('GET', 'config')
+        if status != 200 or not cfg.get('websocketport'):
+            return False
+        host = self._url.split("/")[2]
+        self.events = Events(self.pool, host, cfg['websocketport'])
+        return self.events.connect()
+
+    def update(self):
+        """ Apply light changes received from deCONZ
+
+        If the event stream was lost, reconnect it and reload all lights,
+        because some changes may have been missed. """
+        if self.events is None:
+            return
+        if not self.events.connected:
+            # Don't block the UI by reconnecting on every call
+            if time.time() > self._events_retry:
+                self._events_retry = time.time() + 30
+                if self.events.connect():
+                    self.get_lights()
+            return
+        for e in self.events.read():
+            if e.get('r') != 'lights':
+                continue
+            light = self.get_light_by_id(e.get('id'))
+            if e.get('e') == 'changed' and light is not None:
+                if 'state' in e:
+                    light._merge_remote_state(e['state'])
+                if 'name' in e.get('attr', {}):
+                    light.name = e['attr']['name']
+            elif e.get('e') == 'added' and light is None:
+                if 'on' in e.get('light', {}).get('state', {}):
+                    self._add_light(e['id'], e['light'])
+            elif e.get('e') == 'deleted' and light is not None:
+                del self._index[light.id]
+                self.lights.remove(light)
+
+    async def run(self, period=100):
+        """ Task applying light changes from deCONZ events """
+        while True:
+            self.update()
+            await asyncio.sleep_ms(period)
+
+    def refresh(self):
+        """ Make sure lights are up to date, downloads them only without event stream
+
+        Returns False if deCONZ can't be reached, menus then show the lights known so far. """
+        try:
+            if self.events is not None and self.events.connected:
+                self.update()
+            else:
+                self.get_lights()
+        except Exception as e: # Network isn't up yet
+            print('refresh', e)
+            return False
+        return True
 
     def get_lights(self):
-        self.lights = []
+        """ Download all lights and merge them into the catalog
+
+        The response is parsed as a stream keeping only the fields used by
+        Light, so memory use is bounded by one light not the whole document.
+        Existing Light objects are updated in place, unchanged lights (same etag)
+        are skipped and lights are kept in id order. """
         try:
-            with REST('GET', self.url) as r:
-                d = r[1]
-                for l in d.keys():
-                    if 'on' not in d[l]['state'].keys():
+            ids = []
+            with REST('GET', self.url, pool=self.pool, stream=True) as r:
+                reader = jsonstream.Reader(r[1])
+                for id in reader.keys():
+                    ld = reader.value(LIGHT_FIELDS)
+                    if 'on' not in ld.get('state', {}):
                         continue
-                    self.lights.append(Light(l, self.url, d[l]))
-
-            return True
+                    ids.append(id)
+                    light = self._index.get(id)
+                    if light is None:
+                        self._add_light(id, ld)
+                    elif light.etag is None or light.etag != ld.get('etag'):
+                        light.update(ld)
         except Exception as e:
             raise e
             #print('get_lights', e)
             return False
 
+        # Remove lights deleted in deconz
+        ids = set(ids)
+        for light in [l for l in self.lights if l.id not in ids]:
+            del self._index[light.id]
+            self.lights.remove(light)
+        self.lights.sort(key=lambda l: _id_key(l.id))
+        return True
+
+    def _add_light(self, id, d):
+        light = Light(id, self.url, d, self.pool)
+        self._index[id] = light
+        self.lights.append(light)
+        return light
+
+    async def set_states(self, states, progress=None):
+        """ Send states to several lights concurrently
+
+        states: list of (Light, remote state) pairs
+        returns list of lights that failed """
+        fan = FanOut(self.pool)
+        for light, state in states:
+            fan.add(light, 'PUT', f'{light.url}/state', state)
+        res = await fan.arun(progress)
+        return [l for l, _ in states if res[l][0] != 200]
+
+    def _request(self, method, path, data=None):
+        """ Send request to deCONZ API, returns (status, data), status is None on error """
+        try:
+            with REST(method, f'{self.api}/{path}', data, self.pool) as r:
+                return r
+        except Exception as e:
+            print('request', path, e)
+            return None, None
+
+    def _create(self, path, name):
+        """ Create group or scene, returns its id """
+        status, d = self._request('POST', path, {'name': name})
+        if status == 200:
+            return d[0]['success']['id']
+
+    async def sync_scene(self, name, states, ids=None):
+        """ Create or update group with scene containing the light states
+
+        name: name of the group and scene
+        states: {light id: local light state}
+        ids: (group id, scene id) from previous sync
+        returns (group id, scene id) or None on failure """
+        gid, sid = ids if ids else (None, None)
+        # Check if the group still exists, otherwise find it by name or create it
+        status, group = self._request('GET', f'groups/{gid}') if gid else (None, None)
+        if status != 200 or group.get('name') != name:
+            gid = None
+            status, groups = self._request('GET', 'groups')
+            if status != 200:
+                return None
+            for i, g in groups.items():
+                if g.get('name') == name:
+                    gid, group = i, g
+                    break
+            else:
+                gid = self._create('groups', name)
+                group = {}
+        if gid is None:
+            return None
+
+        if sorted(group.get('lights', [])) != sorted(states.keys()):
+            status, _ = self._request('PUT', f'groups/{gid}', {'lights': list(states.keys())})
+            if status != 200:
+                return None
+
+        # Use the scene from previous sync, or one with the same name, create it only if there is none
+        scenes = group.get('scenes', [])
+        if sid not in [sc['id'] for sc in scenes]:
+            for sc in scenes:
+                if sc.get('name') == name:
+                    sid = sc['id']
+                    break
+            else:
+                sid = self._create(f'groups/{gid}/scenes', name)
+                if sid is None:
+                    return None
+
+        # Store light states in the scene
+        fan = FanOut(self.pool)
+        for light_id, state in states.items():
+            fan.add(light_id, 'PUT', f'{self.api}/groups/{gid}/scenes/{sid}/lights/{light_id}/state',
+                    remote_state(state))
+        for status, _ in (await fan.arun()).values():
+            if status != 200:
+                return None
+        return gid, sid
+
+    def recall_scene(self, gid, sid):
+        """ Recall scene, all lights in the group change at once. Returns HTTP status """
+        return self._request('PUT', f'groups/{gid}/scenes/{sid}/recall')[0]
+
+    def group_action(self, gid, action):
+        """ Set state of all lights in the group at once. Returns HTTP status """
+        return self._request('PUT', f'groups/{gid}/action', action)[0]
+
     def get_light_by_id(self, id):
-        for light in self.lights:
-            if light.id == id:
-                return light
+        return self._index.get(id)
 
 #d = Display()
 #system.start_wifi(d)
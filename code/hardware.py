@@ -1,19 +1,57 @@
-from machine import Pin, PWM
-from utime import sleep_ms, sleep_us
+import uasyncio as asyncio
+from machine import Pin, PWM, Timer, mem32
+from utime import sleep_ms, sleep_us, ticks_ms, ticks_us, ticks_add, ticks_diff
+from lcd_api import LcdApi, ShadowLcd
 
 
-def check_key(pin, down, pressed):
-    k = pin.value()
-    if k != down:
-        down = not down
-        pressed = k
-    else:
-        pressed = False
-    return down, pressed
+# GPIO registers, inputs 32-39 are in IN1
+GPIO_OUT_W1TS = 0x3FF44008
+GPIO_OUT_W1TC = 0x3FF4400C
+GPIO_IN = 0x3FF4403C
+GPIO_IN1 = 0x3FF44040
+
+# Keys in bit order of the key mask, 8 bits for each drive line (top, bottom, left)
+# Inputs of a line are packed into one byte from both input registers:
+# bits 0-4 GPIO 32-36, bits 5-6 GPIO 25-26, bit 7 GPIO 39
+KEYS = ('kzprava', 'four', 'one', 'red', 'three', 'five', 'six', 'two',
+        'up', 'zrusit', 'seven', 'revize', 'nine', 'zero', 'potvrz', 'eight',
+        'down', 'right', None, None, None, 'straight', 'left', None)
+KEY_RELEASED = 0x80 # Flag of release events, lower bits are index in KEYS
+
+
+def _key(bit):
+    return property(lambda self: self._pressed & bit != 0)
 
 
 class Keypad():
-    def __init__(self):
+    """ 3x8 key matrix scanned by a hardware timer
+
+    Debounced presses and releases are queued in a ring buffer, so keys
+    pressed while the program is busy are not lost. Key state is kept as a
+    bitmask with bits in KEYS order. """
+    # Key pressed, set by get_keys
+    p_kzprava = _key(1 << 0)
+    p_four = _key(1 << 1)
+    p_one = _key(1 << 2)
+    p_red = _key(1 << 3)
+    p_three = _key(1 << 4)
+    p_five = _key(1 << 5)
+    p_six = _key(1 << 6)
+    p_two = _key(1 << 7)
+    p_up = _key(1 << 8)
+    p_zrusit = _key(1 << 9)
+    p_seven = _key(1 << 10)
+    p_revize = _key(1 << 11)
+    p_nine = _key(1 << 12)
+    p_zero = _key(1 << 13)
+    p_potvrz = _key(1 << 14)
+    p_eight = _key(1 << 15)
+    p_down = _key(1 << 16)
+    p_right = _key(1 << 17)
+    p_straight = _key(1 << 21)
+    p_left = _key(1 << 22)
+
+    def __init__(self, period=5, queue=16):
         # Pins
         self.k_1 = Pin(36, Pin.IN)
         self.k_2 = Pin(39, Pin.IN)
@@ -28,54 +66,110 @@ class Keypad():
         self.k_left = Pin(12, Pin.OUT)
         self.backlight = Pin(13, Pin.OUT)
         self.backlight_on()
+        self._lines = (self.k_top, self.k_bottom, self.k_left)
+
+        self._pressed = 0 # Key taken by get_keys
+        self._down = 0 # Debounced key down
+        self._cnt0 = 0 # Vertical counter, key is toggled after 4 scans different from _down
+        self._cnt1 = 0
+        self._queue = bytearray(queue) # Ring buffer of key events
+        self._head = 0 # Written by the scan
+        self._tail = 0 # Read by get_event
+        self._flag = asyncio.ThreadSafeFlag()
+        self._period = period
+        self._scan_cb = self._scan # Bound once, not in every callback
+        self._timer = Timer(0)
+        self.resume()
+
+    def suspend(self):
+        """ Stop scanning and drive all lines high, so any key press pulls its input high """
+        self._timer.deinit()
+        for line in self._lines:
+            line.value(1)
+
+    def resume(self):
+        """ Start scanning keys """
+        for line in self._lines:
+            line.value(0)
+        self._timer.init(period=self._period, mode=Timer.PERIODIC, callback=self._scan_cb)
+
+    def _scan(self, _):
+        # Timer callback, doesn't allocate
+        raw = (self._read_line(1 << 27) | self._read_line(1 << 14) << 8 |
+               self._read_line(1 << 12) << 16)
+        # Each bit of the mask counts its own key, all at once
+        delta = raw ^ self._down
+        self._cnt1 = (self._cnt1 ^ self._cnt0) & delta
+        self._cnt0 = ~self._cnt0 & delta
+        toggle = delta & ~(self._cnt0 | self._cnt1)
+        if not toggle:
+            return
+        self._down ^= toggle
+        i = 0
+        while toggle:
+            if toggle & 1:
+                self._push(i if self._down & (1 << i) else i | KEY_RELEASED)
+            toggle >>= 1
+            i += 1
+
+    def _read_line(self, line):
+        """ Drive line high and read its 8 inputs as one byte """
+        mem32[GPIO_OUT_W1TS] = line
+        sleep_us(2) # Let the input settle
+        raw = mem32[GPIO_IN1] & 0x9f | mem32[GPIO_IN] >> 20 & 0x60
+        mem32[GPIO_OUT_W1TC] = line
+        return raw
+
+    def _push(self, event):
+        head = self._head + 1
+        if head == len(self._queue):
+            head = 0
+        if head != self._tail: # Drop events when the queue is full
+            self._queue[self._head] = event
+            self._head = head
+        self._flag.set()
+
+    def get_event(self):
+        """ Take next event from the queue, index in KEYS with KEY_RELEASED flag, -1 if empty """
+        if self._tail == self._head:
+            return -1
+        event = self._queue[self._tail]
+        tail = self._tail + 1
+        self._tail = 0 if tail == len(self._queue) else tail
+        return event
 
-        # Key pressed
-        self.p_one = False
-        self.p_two = False
-        self.p_three = False
-        self.p_four = False
-        self.p_five = False
-        self.p_six = False
-        self.p_seven = False
-        self.p_eight = False
-        self.p_nine = False
-        self.p_zero = False
-        self.p_kzprava = False
-        self.p_red = False
-        self.p_revize = False
-        self.p_potvrz = False
-        self.p_zrusit = False
-        self.p_up = False
-        self.p_down = False
-        self.p_left = False
-        self.p_right = False
-        self.p_straight = False
-        # Key down
-        self._one = False
-        self._two = False
-        self._three = False
-        self._four = False
-        self._five = False
-        self._six = False
-        self._seven = False
-        self._eight = False
-        self._nine = False
-        self._zero = False
-        self._kzprava = False
-        self._red = False
-        self._revize = False
-        self._potvrz = False
-        self._zrusit = False
-        self._up = False
-        self._down = False
-        self._left = False
-        self._right = False
-        self._straight = False
+    def get_keys(self):
+        """ Take next key press from the queue into p_* attributes
+
+        Returns False if no key was pressed. """
+        self._pressed = 0
+        while True:
+            event = self.get_event()
+            if event < 0:
+                return False
+            if not event & KEY_RELEASED and KEYS[event]:
+                self._pressed = 1 << event
+                return True
+
+    async def wait_keys(self, timeout=None):
+        """ Wait for key press, returns False if timeout (ms) has passed first """
+        if timeout is not None:
+            end = ticks_add(ticks_ms(), timeout)
+        while not self.get_keys():
+            if timeout is None:
+                await self._flag.wait()
+                continue
+            left = ticks_diff(end, ticks_ms())
+            if left <= 0:
+                return False
+            try:
+                await asyncio.wait_for_ms(self._flag.wait(), left)
+            except asyncio.TimeoutError:
+                return self.get_keys()
+        return True
 
     def any_pressed(self):
-        return any((self.p_one, self.p_two, self.p_three, self.p_four, self.p_five, self.p_six, self.p_seven,
-                   self.p_eight, self.p_nine, self.p_zero, self.p_kzprava, self.p_red, self.p_revize, 
-                   self.p_potvrz, self.p_zrusit, self.p_up, self.p_down, self.p_left, self.p_right, self.p_straight))
+        return self._pressed != 0
 
     def backlight_on(self):
         self.backlight.on()
@@ -83,249 +177,17 @@ class Keypad():
     def backlight_off(self):
         self.backlight.off()
 
-    def get_keys(self):
-        for n, p in enumerate((self.k_top, self.k_bottom, self.k_left)):
-            p.value(True)
-            if n == 0:
-                self._three, self.p_three = check_key(self.k_1, self._three, self.p_three)
-                self._two, self.p_two = check_key(self.k_2, self._two, self.p_two)
-                self._one, self.p_one = check_key(self.k_3, self._one, self.p_one)
-                self._red, self.p_red = check_key(self.k_4, self._red, self.p_red)
-                self._kzprava, self.p_kzprava = check_key(self.k_5, self._kzprava, self.p_kzprava)
-                self._four, self.p_four = check_key(self.k_6, self._four, self.p_four)
-                self._five, self.p_five = check_key(self.k_7, self._five, self.p_five)
-                self._six, self.p_six = check_key(self.k_8, self._six, self.p_six)
-            if n == 1:
-                self._nine, self.p_nine = check_key(self.k_1, self._nine, self.p_nine)
-                self._eight, self.p_eight = check_key(self.k_2, self._eight, self.p_eight)
-                self._seven, self.p_seven = check_key(self.k_3, self._seven, self.p_seven)
-                self._revize, self.p_revize = check_key(self.k_4, self._revize, self.p_revize)
-                self._up, self.p_up = check_key(self.k_5, self._up, self.p_up)
-                self._zrusit, self.p_zrusit = check_key(self.k_6, self._zrusit, self.p_zrusit)
-                self._zero, self.p_zero = check_key(self.k_7, self._zero, self.p_zero)
-                self._potvrz, self.p_potvrz = check_key(self.k_8, self._potvrz, self.p_potvrz)
-            if n == 2:
-                self._down, self.p_down = check_key(self.k_5, self._down, self.p_down)
-                self._right, self.p_right = check_key(self.k_6, self._right, self.p_right)
-                self._straight, self.p_straight = check_key(self.k_7, self._straight, self.p_straight)
-                self._left, self.p_left = check_key(self.k_8, self._left, self.p_left)
-            p.value(False)
-
-
-# lcd_api by dhylands
-class LcdApi:
-    """Implements the API for talking with HD44780 compatible character LCDs.
-    This class only knows what commands to send to the LCD, and not how to get
-    them to the LCD.
-
-    It is expected that a derived class will implement the hal_xxx functions.
-    """
-
-    # The following constant names were lifted from the avrlib lcd.h
-    # header file, however, I changed the definitions from bit numbers
-    # to bit masks.
-    #
-    # HD44780 LCD controller command set
-
-    LCD_CLR = 0x01              # DB0: clear display
-    LCD_HOME = 0x02             # DB1: return to home position
-
-    LCD_ENTRY_MODE = 0x04       # DB2: set entry mode
-    LCD_ENTRY_INC = 0x02        # --DB1: increment
-    LCD_ENTRY_SHIFT = 0x01      # --DB0: shift
-
-    LCD_ON_CTRL = 0x08          # DB3: turn lcd/cursor on
-    LCD_ON_DISPLAY = 0x04       # --DB2: turn display on
-    LCD_ON_CURSOR = 0x02        # --DB1: turn cursor on
-    LCD_ON_BLINK = 0x01         # --DB0: blinking cursor
-
-    LCD_MOVE = 0x10             # DB4: move cursor/display
-    LCD_MOVE_DISP = 0x08        # --DB3: move display (0-> move cursor)
-    LCD_MOVE_RIGHT = 0x04       # --DB2: move right (0-> left)
-
-    LCD_FUNCTION = 0x20         # DB5: function set
-    LCD_FUNCTION_8BIT = 0x10    # --DB4: set 8BIT mode (0->4BIT mode)
-    LCD_FUNCTION_2LINES = 0x08  # --DB3: two lines (0->one line)
-    LCD_FUNCTION_10DOTS = 0x04  # --DB2: 5x10 font (0->5x7 font)
-    LCD_FUNCTION_RESET = 0x30   # See "Initializing by Instruction" section
-
-    LCD_CGRAM = 0x40            # DB6: set CG RAM address
-    LCD_DDRAM = 0x80            # DB7: set DD RAM address
-
-    LCD_RS_CMD = 0
-    LCD_RS_DATA = 1
-
-    LCD_RW_WRITE = 0
-    LCD_RW_READ = 1
-
-    def __init__(self, num_lines, num_columns):
-        self.num_lines = num_lines
-        if self.num_lines > 4:
-            self.num_lines = 4
-        self.num_columns = num_columns
-        if self.num_columns > 40:
-            self.num_columns = 40
-        self.cursor_x = 0
-        self.cursor_y = 0
-        self.implied_newline = False
-        self.backlight = True
-        self.display_off()
-        self.backlight_on()
-        self.clear()
-        self.hal_write_command(self.LCD_ENTRY_MODE | self.LCD_ENTRY_INC)
-        self.hide_cursor()
-        self.display_on()
-
-    def clear(self):
-        """Clears the LCD display and moves the cursor to the top left
-        corner.
-        """
-        self.hal_write_command(self.LCD_CLR)
-        self.hal_write_command(self.LCD_HOME)
-        self.cursor_x = 0
-        self.cursor_y = 0
-
-    def show_cursor(self):
-        """Causes the cursor to be made visible."""
-        self.hal_write_command(self.LCD_ON_CTRL | self.LCD_ON_DISPLAY |
-                               self.LCD_ON_CURSOR)
-
-    def hide_cursor(self):
-        """Causes the cursor to be hidden."""
-        self.hal_write_command(self.LCD_ON_CTRL | self.LCD_ON_DISPLAY)
-
-    def blink_cursor_on(self):
-        """Turns on the cursor, and makes it blink."""
-        self.hal_write_command(self.LCD_ON_CTRL | self.LCD_ON_DISPLAY |
-                               self.LCD_ON_CURSOR | self.LCD_ON_BLINK)
-
-    def blink_cursor_off(self):
-        """Turns on the cursor, and makes it no blink (i.e. be solid)."""
-        self.hal_write_command(self.LCD_ON_CTRL | self.LCD_ON_DISPLAY |
-                               self.LCD_ON_CURSOR)
-
-    def display_on(self):
-        """Turns on (i.e. unblanks) the LCD."""
-        self.hal_write_command(self.LCD_ON_CTRL | self.LCD_ON_DISPLAY)
-
-    def display_off(self):
-        """Turns off (i.e. blanks) the LCD."""
-        self.hal_write_command(self.LCD_ON_CTRL)
-
-    def backlight_on(self):
-        """Turns the backlight on.
-
-        This isn't really an LCD command, but some modules have backlight
-        controls, so this allows the hal to pass through the command.
-        """
-        self.backlight = True
-        self.hal_backlight_on()
-
-    def backlight_off(self):
-        """Turns the backlight off.
-
-        This isn't really an LCD command, but some modules have backlight
-        controls, so this allows the hal to pass through the command.
-        """
-        self.backlight = False
-        self.hal_backlight_off()
-
-    def move_to(self, cursor_x, cursor_y):
-        """Moves the cursor position to the indicated position. The cursor
-        position is zero based (i.e. cursor_x == 0 indicates first column).
-        """
-        self.cursor_x = cursor_x
-        self.cursor_y = cursor_y
-        addr = cursor_x & 0x3f
-        if cursor_y & 1:
-            addr += 0x40    # Lines 1 & 3 add 0x40
-        if cursor_y & 2:    # Lines 2 & 3 add number of columns
-            addr += self.num_columns
-        self.hal_write_command(self.LCD_DDRAM | addr)
-
-    def putchar(self, char):
-        """Writes the indicated character to the LCD at the current cursor
-        position, and advances the cursor by one position.
-        """
-        if char == '\n':
-            if self.implied_newline:
-                # self.implied_newline means we advanced due to a wraparound,
-                # so if we get a newline right after that we ignore it.
-                self.implied_newline = False
-            else:
-                self.cursor_x = self.num_columns
-        else:
-            self.hal_write_data(ord(char))
-            self.cursor_x += 1
-        if self.cursor_x >= self.num_columns:
-            self.cursor_x = 0
-            self.cursor_y += 1
-            self.implied_newline = (char != '\n')
-        if self.cursor_y >= self.num_lines:
-            self.cursor_y = 0
-        self.move_to(self.cursor_x, self.cursor_y)
-
-    def putstr(self, string):
-        """Write the indicated string to the LCD at the current cursor
-        position and advances the cursor position appropriately.
-        """
-        for char in string:
-            self.putchar(char)
-
-    def custom_char(self, location, charmap):
-        """Write a character to one of the 8 CGRAM locations, available
-        as chr(0) through chr(7).
-        """
-        location &= 0x7
-        self.hal_write_command(self.LCD_CGRAM | (location << 3))
-        self.hal_sleep_us(40)
-        for i in range(8):
-            self.hal_write_data(charmap[i])
-            self.hal_sleep_us(40)
-        self.move_to(self.cursor_x, self.cursor_y)
-
-    def hal_backlight_on(self):
-        """Allows the hal layer to turn the backlight on.
-
-        If desired, a derived HAL class will implement this function.
-        """
-        pass
-
-    def hal_backlight_off(self):
-        """Allows the hal layer to turn the backlight off.
-
-        If desired, a derived HAL class will implement this function.
-        """
-        pass
-
-    def hal_write_command(self, cmd):
-        """Write a command to the LCD.
-
-        It is expected that a derived HAL class will implement this
-        function.
-        """
-        raise NotImplementedError
-
-    def hal_write_data(self, data):
-        """Write data to the LCD.
-
-        It is expected that a derived HAL class will implement this
-        function.
-        """
-        raise NotImplementedError
-
-    # This is a default implementation of hal_sleep_us which is suitable
-    # for most micropython implementations. For platforms which don't
-    # support `time.sleep_us()` they should provide their own implementation
-    # of hal_sleep_us in their hal layer and it will be used instead.
-    def hal_sleep_us(self, usecs):
-        """Sleep for some time (given in microseconds)."""
-        sleep_us(usecs)  # NOTE this is not part of Standard Python library, specific hal layers will need to override this
-
 
+# gpio_lcd by dhylands
 class GpioLcd(LcdApi):
     """Implements a HD44780 character LCD connected via ESP32 GPIO pins."""
 
+    # Execution times with some margin over the datasheet (37us and 1.52ms at
+    # 270 kHz), the controller oscillator may run slower than nominal
+    CMD_US = 50
+    CLEAR_US = 2000
+    BUSY_TIMEOUT_US = 10000
+
     def __init__(self, rs_pin, enable_pin, d0_pin=None, d1_pin=None,
                  d2_pin=None, d3_pin=None, d4_pin=None, d5_pin=None,
                  d6_pin=None, d7_pin=None, rw_pin=None, backlight_pin=None,
@@ -342,13 +204,18 @@ class GpioLcd(LcdApi):
 
         The enable 8-bit mode, you need pass d0 through d7.
 
-        The rw pin isn't used by this library, but if you specify it, then
-        it will be set low.
+        If the rw pin is specified, the busy flag is read before each write,
+        so commands wait only as long as the controller needs. The data pins
+        are driven by the LCD while reading, so they must tolerate its supply
+        voltage. Without the rw pin, the next write waits until the execution
+        time of the previous one (CMD_US or CLEAR_US) has passed.
         """
         self.rs_pin = rs_pin
         self.enable_pin = enable_pin
         self.rw_pin = rw_pin
         self.backlight_pin = backlight_pin
+        self.busy_flag = False # Read busy flag instead of waiting fixed time
+        self._ready = ticks_us() # When is the controller ready in timing mode
         self._4bit = True
         if d4_pin and d5_pin and d6_pin and d7_pin:
             self.d0_pin = d0_pin
@@ -415,6 +282,8 @@ class GpioLcd(LcdApi):
             cmd |= self.LCD_FUNCTION_8BIT
         self.hal_write_init_nibble(cmd)
         sleep_ms(1)
+        # Busy flag can be read once the interface width is set
+        self.busy_flag = self.rw_pin is not None
         LcdApi.__init__(self, num_lines, num_columns)
         if num_lines > 1:
             cmd |= self.LCD_FUNCTION_2LINES
@@ -422,12 +291,10 @@ class GpioLcd(LcdApi):
 
     def hal_pulse_enable(self):
         """Pulse the enable line high, and then low again."""
-        self.enable_pin.value(0)
-        sleep_us(1)
         self.enable_pin.value(1)
         sleep_us(1)       # Enable pulse needs to be > 450 nsec
         self.enable_pin.value(0)
-        sleep_us(100)     # Commands need > 37us to settle
+        # Settling of the whole byte is handled by hal_wait_ready
 
     def hal_write_init_nibble(self, nibble):
         """Writes an initialization nibble to the LCD.
@@ -451,17 +318,57 @@ class GpioLcd(LcdApi):
 
         Data is latched on the falling edge of E.
         """
+        self.hal_wait_ready()
         self.rs_pin.value(0)
         self.hal_write_8bits(cmd)
-        if cmd <= 3:
-            # The home and clear commands require a worst
-            # case delay of 4.1 msec
-            sleep_ms(5)
+        # The home and clear commands take much longer
+        self._ready = ticks_add(ticks_us(), self.CLEAR_US if cmd <= 3 else self.CMD_US)
 
     def hal_write_data(self, data):
         """Write data to the LCD."""
+        self.hal_wait_ready()
         self.rs_pin.value(1)
         self.hal_write_8bits(data)
+        self._ready = ticks_add(ticks_us(), self.CMD_US)
+
+    def hal_wait_ready(self):
+        """Wait until the controller finished the previous command.
+
+        Time spent in Python since the last write counts towards the wait.
+        """
+        if self.busy_flag:
+            if not self.hal_read_busy():
+                # Busy flag doesn't work (rw not connected?), use timing
+                self.busy_flag = False
+            return
+        left = ticks_diff(self._ready, ticks_us())
+        if left > 0:
+            sleep_us(left)
+
+    def hal_read_busy(self):
+        """Poll the busy flag until it clears, returns False on timeout."""
+        pins = (self.d4_pin, self.d5_pin, self.d6_pin, self.d7_pin)
+        if not self._4bit:
+            pins += (self.d0_pin, self.d1_pin, self.d2_pin, self.d3_pin)
+        for pin in pins:
+            pin.init(Pin.IN)
+        self.rs_pin.value(0)
+        self.rw_pin.value(1)
+        start = ticks_us()
+        while True:
+            self.enable_pin.value(1)
+            sleep_us(1)   # Data is valid 360 nsec after rising edge
+            busy = self.d7_pin.value()
+            self.enable_pin.value(0)
+            if self._4bit:
+                # Second nibble holds the address counter, it has to be clocked out
+                self.hal_pulse_enable()
+            if not busy or ticks_diff(ticks_us(), start) > self.BUSY_TIMEOUT_US:
+                break
+        self.rw_pin.value(0)
+        for pin in pins:
+            pin.init(Pin.OUT)
+        return not busy
 
     def hal_write_8bits(self, value):
         """Writes 8 bits of data to the LCD."""
@@ -484,26 +391,32 @@ class GpioLcd(LcdApi):
         self.d5_pin.value(nibble & 0x02)
         self.d4_pin.value(nibble & 0x01)
         self.hal_pulse_enable()
-# End of lcd_api by dhylands
+# End of gpio_lcd by dhylands
 
 
 # Display simplification
-class Display(GpioLcd):
+class Display(ShadowLcd, GpioLcd):
+    """ 4x20 display of the panel """
     def __init__(self):
+        ShadowLcd.__init__(self, 4, 20)
         # RS, Enable, D4, D5, D6, D7 
         self._backlight = PWM(Pin(15))
         self.backlight_on()
-        super().__init__(Pin(22), Pin(23), Pin(16),
+        GpioLcd.__init__(self, Pin(22), Pin(23), Pin(16),
                          Pin(17), Pin(18), Pin(19),
                          num_lines=4, num_columns=20)
-        
-    def print(self, string, pos=None):
-        if pos:
-            self.move_to(*pos)
-        self.putstr(string)
+        LcdApi.clear(self) # Make sure the LCD matches the framebuffer
+
+    async def run(self, period=20):
+        """ Flush changes every period ms """
+        self.autoflush = False
+        while True:
+            if self.dirty:
+                self.flush()
+            await asyncio.sleep_ms(period)
 
     def backlight_on(self):
         self._backlight.duty(1023)
 
     def backlight_off(self):
-        self._backlight.duty(0)
\ No newline at end of file
+        self._backlight.duty(0)
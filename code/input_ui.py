@@ -1,8 +1,11 @@
+import uasyncio as asyncio
+
+
 CHARS_MIN = ' abcdefghijklmnopqrstuvwxyz'
 CHARS_ALL = ' abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789,.;:-_=+!@#$%&*'
 
 
-def text_input_ui(display, keypad, title, answer=' ', min_chars=True):
+async def text_input_ui(display, keypad, title, answer=' ', min_chars=True):
     """ Text input UI
 
     Max 20 characters, spaces at the start and end will be striped,
@@ -28,7 +31,7 @@ def text_input_ui(display, keypad, title, answer=' ', min_chars=True):
     cancel = False
 
     while True:
-        keypad.get_keys()
+        await keypad.wait_keys()
 
         if keypad.p_zrusit:
             cancel = True
@@ -87,5 +90,9 @@ if __name__ == "__main__":
     from hardware import Keypad, Display
     display = Display()
     keypad = Keypad()
-    print(text_input_ui(display, keypad, 'Minimal'))
-    print(text_input_ui(display, keypad, 'All', 'Testing', False))
\ No newline at end of file
+
+    async def test():
+        asyncio.create_task(display.run())
+        print(await text_input_ui(display, keypad, 'Minimal'))
+        print(await text_input_ui(display, keypad, 'All', 'Testing', False))
+    asyncio.run(test())
\ No newline at end of file
@@ -0,0 +1,167 @@
+""" Streaming JSON parser
+
+Reads JSON from a stream in fixed size chunks and keeps only the requested
+fields, so memory used is bounded by the kept data, not the whole document.
+
+Fields to keep are described by a spec:
+    None - skip the value
+    True - keep the whole value
+    dict - object, keep only keys in the dict, each with its own spec
+"""
+
+_ESCAPES = {ord('"'): '"', ord('\\'): '\\', ord('/'): '/', ord('b'): '\b',
+            ord('f'): '\f', ord('n'): '\n', ord('r'): '\r', ord('t'): '\t'}
+_WS = b' \t\r\n'
+_NUM = b'+-0123456789.eE'
+
+
+class Reader():
+    def __init__(self, stream, chunk=256):
+        self.stream = stream
+        self.buf = bytearray(chunk)
+        self.mv = memoryview(self.buf)
+        self.pos = 0
+        self.end = 0
+
+    def _fill(self):
+        self.pos = 0
+        self.end = self.stream.readinto(self.mv) or 0
+        if self.end == 0:
+            raise ValueError("Unexpected end of JSON")
+
+    def _next(self):
+        """ Consume and return next byte """
+        if self.pos == self.end:
+            self._fill()
+        c = self.buf[self.pos]
+        self.pos += 1
+        return c
+
+    def peek(self):
+        """ Return next non-whitespace byte without consuming it """
+        while True:
+            if self.pos == self.end:
+                self._fill()
+            c = self.buf[self.pos]
+            if c not in _WS:
+                return c
+            self.pos += 1
+
+    def _expect(self, c):
+        if self.peek() != c:
+            raise ValueError("Expected %s" % chr(c))
+        self.pos += 1
+
+    def keys(self):
+        """ Iterate over keys of an object, caller has to read or skip each value """
+        self._expect(ord('{'))
+        if self.peek() == ord('}'):
+            self.pos += 1
+            return
+        while True:
+            self.peek()
+            k = self._string(True)
+            self._expect(ord(':'))
+            yield k
+            c = self.peek()
+            self.pos += 1
+            if c == ord('}'):
+                return
+            if c != ord(','):
+                raise ValueError("Expected , or }")
+
+    def skip(self):
+        self.value(None)
+
+    def value(self, spec=True):
+        """ Read next value, keeping only fields described by spec """
+        c = self.peek()
+        if c == ord('{'):
+            d = {} if spec else None
+            for k in self.keys():
+                sub = spec if spec is True else spec.get(k) if spec else None
+                v = self.value(sub)
+                if sub:
+                    d[k] = v
+            return d
+        if c == ord('['):
+            self.pos += 1
+            l = [] if spec else None
+            if self.peek() == ord(']'):
+                self.pos += 1
+                return l
+            while True:
+                v = self.value(spec)
+                if spec:
+                    l.append(v)
+                c = self.peek()
+                self.pos += 1
+                if c == ord(']'):
+                    return l
+                if c != ord(','):
+                    raise ValueError("Expected , or ]")
+        if c == ord('"'):
+            return self._string(spec)
+        if c == ord('t'):
+            self._literal(b'true')
+            return True
+        if c == ord('f'):
+            self._literal(b'false')
+            return False
+        if c == ord('n'):
+            self._literal(b'null')
+            return None
+        return self._number(spec)
+
+    def _literal(self, word):
+        for c in word:
+            if self._next() != c:
+                raise ValueError("Invalid literal")
+
+    def _number(self, keep):
+        s = bytearray()
+        while True:
+            if self.pos == self.end:
+                self.pos = 0
+                self.end = self.stream.readinto(self.mv) or 0
+                if self.end == 0:
+                    break # Number at the end of the document
+            c = self.buf[self.pos]
+            if c not in _NUM:
+                break
+            s.append(c)
+            self.pos += 1
+        if not s:
+            raise ValueError("Invalid JSON")
+        if not keep:
+            return None
+        s = str(s, 'utf-8')
+        if '.' in s or 'e' in s or 'E' in s:
+            return float(s)
+        return int(s)
+
+    def _string(self, keep):
+        if self._next() != ord('"'):
+            raise ValueError("Expected string")
+        s = bytearray() if keep else None
+        while True:
+            c = self._next()
+            if c == ord('"'):
+                break
+            if c == ord('\\'):
+                c = self._next()
+                if c == ord('u'):
+                    code = self._hex4()
+                    if 0xd800 <= code < 0xdc00: # Surrogate pair
+                        self._next(), self._next()
+                        code = 0x10000 + ((code - 0xd800) << 10) + self._hex4() - 0xdc00
+                    if keep:
+                        s += chr(code).encode()
+                elif keep:
+                    s += _ESCAPES.get(c, chr(c)).encode()
+            elif keep:
+                s.append(c)
+        return str(s, 'utf-8') if keep else None
+
+    def _hex4(self):
+        return int(bytes(self._next() for _ in range(4)), 16)
@@ -0,0 +1,117 @@
+""" Simulated HD44780 for running the UI without the hardware
+
+Models DDRAM, CGRAM and the address counter, so the screen can be rendered
+as text, and counts what was sent to the controller, to see how much bus
+time drawing costs. Runs on MicroPython and CPython. """
+from lcd_api import LcdApi, ShadowLcd
+
+
+class SimLcd(LcdApi):
+    """ LcdApi HAL writing into a model of the controller """
+    # Execution times from the datasheet at 270 kHz
+    CMD_US = 37
+    CLEAR_US = 1520
+
+    def __init__(self, num_lines=4, num_columns=20):
+        self.ddram = bytearray(b' ' * 128) # Indexed by DDRAM address
+        self.cgram = bytearray(64)
+        self.addr = 0 # Address counter
+        self.cg = False # Address counter points to CGRAM
+        self.inc = 1 # Entry mode direction
+        self.control = 0 # Display, cursor and blink bits
+        self.commands = 0
+        self.data = 0
+        self.slept_us = 0 # Waits requested by the driver
+        self.exec_us = 0 # Time the controller spends executing
+        LcdApi.__init__(self, num_lines, num_columns)
+        self.frame()
+
+    def hal_write_command(self, cmd):
+        self.commands += 1
+        self.exec_us += self.CLEAR_US if cmd <= 3 else self.CMD_US
+        if cmd & self.LCD_DDRAM:
+            self.addr = cmd & 0x7f
+            self.cg = False
+        elif cmd & self.LCD_CGRAM:
+            self.addr = cmd & 0x3f
+            self.cg = True
+        elif cmd & self.LCD_FUNCTION:
+            pass
+        elif cmd & self.LCD_MOVE:
+            if not cmd & self.LCD_MOVE_DISP:
+                self._advance(1 if cmd & self.LCD_MOVE_RIGHT else -1)
+        elif cmd & self.LCD_ON_CTRL:
+            self.control = cmd & 0x07
+        elif cmd & self.LCD_ENTRY_MODE:
+            self.inc = 1 if cmd & self.LCD_ENTRY_INC else -1
+        elif cmd & self.LCD_HOME:
+            self.addr = 0
+            self.cg = False
+        elif cmd & self.LCD_CLR:
+            for i in range(len(self.ddram)):
+                self.ddram[i] = 32
+            self.addr = 0
+            self.cg = False
+            self.inc = 1
+
+    def hal_write_data(self, data):
+        self.data += 1
+        self.exec_us += self.CMD_US
+        if self.cg:
+            self.cgram[self.addr] = data
+        else:
+            self.ddram[self.addr] = data
+        self._advance(self.inc)
+
+    def hal_sleep_us(self, usecs):
+        self.slept_us += usecs
+
+    def _advance(self, step):
+        """ Move address counter, two line DDRAM is 0x00-0x27 and 0x40-0x67 """
+        if self.cg:
+            self.addr = (self.addr + step) & 0x3f
+            return
+        a = self.addr + step
+        if a == 0x28:
+            a = 0x40
+        elif a == 0x68:
+            a = 0x00
+        elif a == 0x3f:
+            a = 0x27
+        elif a == -1:
+            a = 0x67
+        self.addr = a
+
+    def frame(self):
+        """ Return counters since the last frame and reset them """
+        f = {'commands': self.commands,
+             'data': self.data,
+             'sleep_us': self.slept_us,
+             'bus_us': self.exec_us + self.slept_us}
+        self.commands = self.data = self.slept_us = self.exec_us = 0
+        return f
+
+    def text(self):
+        """ Screen as lines of text, custom glyphs are shown as * """
+        rows = []
+        for y in range(self.num_lines):
+            a = self.ddram_addr(0, y)
+            row = ''
+            for c in self.ddram[a:a + self.num_columns]:
+                if c < 16:
+                    row += '*'
+                elif c == 0xff:
+                    row += '#' # Full block
+                elif c < 32 or c > 126:
+                    row += '?'
+                else:
+                    row += chr(c)
+            rows.append(row)
+        return '\n'.join(rows)
+
+
+class SimDisplay(ShadowLcd, SimLcd):
+    """ Display of the panel drawing into the simulated controller """
+    def __init__(self, num_lines=4, num_columns=20):
+        ShadowLcd.__init__(self, num_lines, num_columns)
+        SimLcd.__init__(self, num_lines, num_columns)
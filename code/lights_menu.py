@@ -1,4 +1,7 @@
+import time
+import uasyncio as asyncio
 from base_menu import BaseMenu
+from deconz import remote_state
 
 
 def range(start, end, step=1):
@@ -31,17 +34,17 @@ class LightsMenu(BaseMenu):
             self.item_toggles.append(l.state['on'])
         self.n_items = len(items)
 
-    def run(self):
-        if self.empty_menu(): return
+    async def run(self):
+        if await self.empty_menu(): return
         self.draw()
 
         while True:
-            self.keypad.get_keys()
+            await self.keypad.wait_keys()
             if self.keypad.p_zrusit:
                 return False
             # Enter Color Menu
             if self.keypad.p_potvrz:
-                l = ColorMenu(self.items[self.selected], self.display, self.keypad).run()
+                l = await ColorMenu(self.items[self.selected], self.display, self.keypad).run()
                 if l and self.return_light:
                     return l
                 self.draw()
@@ -67,6 +70,50 @@ class LightsMenu(BaseMenu):
                     self.selected = 0
                 self.draw()
 
+class Preview():
+    """ Live preview of light state while sliders are moved
+
+    Only the newest state waits to be sent, older ones are dropped. Sending is
+    limited to one request per interval (ms) and only attributes changed since
+    the last request are sent. """
+    def __init__(self, light, interval=200):
+        self.light = light
+        self.interval = interval
+        self.pending = None
+        self.sent = remote_state(light.state) # Last state sent to the light
+        self.last = time.ticks_ms()
+
+    def push(self, state):
+        """ Replace waiting state with the newest one """
+        self.pending = state.copy()
+
+    def update(self):
+        """ Send waiting state if the interval has passed """
+        if self.pending is None:
+            return
+        if time.ticks_diff(time.ticks_ms(), self.last) < self.interval:
+            return
+        self.send(remote_state(self.pending))
+
+    def send(self, d):
+        """ Send changed attributes of remote state d now """
+        self.pending = None
+        self.last = time.ticks_ms()
+        changed = {k: v for k, v in d.items() if self.sent.get(k) != v}
+        if not changed:
+            return True
+        try:
+            ok = self.light._set_remote_state(changed)
+        except (OSError, ValueError) as e: # Timeout or broken response, keep the menu running
+            print('preview', e)
+            ok = False
+        if ok:
+            self.sent.update(changed)
+            return True
+        self.sent = {} # State of the light is unknown, send everything next time
+        return False
+
+
 class ColorMenu():
     def __init__(self, l, display, keypad):
         self.bar_char = bytearray([0x00,0x1F,0x1F,0x1F,0x1F,0x1F,0x00,0x00])
@@ -77,6 +124,7 @@ class ColorMenu():
         self.on_off = True if l.state['bri'] is None else False # On/off only mode
         self.s = l.state.copy() # State working copy
         self.org_s = l.state.copy() # Original state
+        self.preview = Preview(l)
         # State values, [min, max, step]
         self.sv = {'ct': (140, 650, 25),
                    'bri': (0, 255, 12),
@@ -89,7 +137,6 @@ class ColorMenu():
             self.display.print('On/Off only', (5,1))
             return
 
-        self.display.custom_char(0, self.bar_char)
         self.display.print('CT', (0,0))
         self.display.print('Bri', (0,1))
         self.display.print('Sat', (0,2))
@@ -106,16 +153,17 @@ class ColorMenu():
         maxs = self.sv[name][1]
         step = self.sv[name][2]*2
         curs = self.s[name]
+        bar = self.display.glyph('bar', self.bar_char)
 
         self.display.print('[', (7,y))
         # Draw blocks in the slider
         i = -1
         for i, _ in enumerate(range(mins, curs, step)):
-            self.display.putchar(chr(0))
+            self.display.putchar(bar)
 
         # Workaround for values that are exactly divisible
         if curs == maxs and i == 9:
-            self.display.putchar(chr(0))
+            self.display.putchar(bar)
             i = 10
 
         # draw the rest empty
@@ -139,7 +187,7 @@ class ColorMenu():
             self.draw_slider(2, 'sat') # TODO: sat slider doesn't go to end
             self.draw_slider(3, 'hue') # TODO: hue doesn't go to end
 
-    def run(self):
+    async def run(self):
         self.draw_base()
         cd = True # Change display
         while True:
@@ -147,7 +195,9 @@ class ColorMenu():
                 self.draw()
             cd = False
 
-            self.keypad.get_keys()
+            self.preview.update()
+            # Wake up to send waiting preview even if no key is pressed
+            await self.keypad.wait_keys(None if self.preview.pending is None else self.preview.interval)
             ssel = ('ct', 'bri', 'sat', 'hue')[self.selected] # Selected state name
             sstep = self.sv[ssel]
             
@@ -172,16 +222,14 @@ class ColorMenu():
             if self.keypad.p_left and not self.on_off:
                 if self.s[ssel] is None:
                     continue
-                self.s[ssel] -= sstep[2]
-                if self.s[ssel] < sstep[0]:
-                    self.s[ssel] = sstep[0]
+                self.s[ssel] = max(self.s[ssel] - sstep[2], sstep[0])
+                self.preview.push(self.s)
                 cd = True
             if self.keypad.p_right and not self.on_off:
                 if self.s[ssel] is None:
                     continue
-                self.s[ssel] += sstep[2]
-                if self.s[ssel] > sstep[1]:
-                    self.s[ssel] = sstep[1]
+                self.s[ssel] = min(self.s[ssel] + sstep[2], sstep[1])
+                self.preview.push(self.s)
                 cd = True
             
             if self.keypad.p_zero:
@@ -210,21 +258,21 @@ class ColorMenu():
             self.s['hue'] += 0.01
         else:
             self.s['hue'] -= 0.01
-        self.l.set_color(self.s['on'], self.s['hue'], self.s['sat'], self.s['bri'])
+        self.preview.send(self.l.color_state(self.s['on'], self.s['hue'], self.s['sat'], self.s['bri']))
 
     def switch_to_ctemp(self):
         if self.s['ct'] < self.sv['ct'][1]:
             self.s['ct'] += 1
         else:
             self.s['ct']  -= 1
-        self.l.set_ctemp(self.s['on'], self.s['ct'], self.s['bri'])
+        self.preview.send(self.l.ctemp_state(self.s['on'], self.s['ct'], self.s['bri']))
 
     def toggle(self):
         if self.s['on']:
-            self.l.off()
+            self.preview.send(self.l.off_state())
             self.s['on'] = False
         else:
-            self.l.on()
+            self.preview.send(self.l.on_state())
             self.s['on'] = True
 
 
@@ -232,28 +280,27 @@ class ColorMenu():
         if self.on_off:
             return
         if self.org_s['mode'] == 'color':
-            self.l.set_color(self.org_s['on'],
-                             self.org_s['hue'],
-                             self.org_s['sat'],
-                             self.org_s['bri'])
+            self.preview.send(self.l.color_state(self.org_s['on'],
+                                                 self.org_s['hue'],
+                                                 self.org_s['sat'],
+                                                 self.org_s['bri']))
         else:
-            self.l.set_ctemp(self.org_s['on'],
-                             self.org_s['ct'],
-                             self.org_s['bri'])
+            self.preview.send(self.l.ctemp_state(self.org_s['on'],
+                                                 self.org_s['ct'],
+                                                 self.org_s['bri']))
 
     def apply_changes(self):
         if self.on_off:
             return
         if self.s['mode'] == 'color':
-            self.l.set_color(self.s['on'],
-                             self.s['hue'],
-                             self.s['sat'],
-                             self.s['bri'])
+            self.preview.send(self.l.color_state(self.s['on'],
+                                                 self.s['hue'],
+                                                 self.s['sat'],
+                                                 self.s['bri']))
         else:
-            self.l.set_ctemp(self.s['on'],
-                             self.s['ct'],
-                             self.s['bri'])
-
+            self.preview.send(self.l.ctemp_state(self.s['on'],
+                                                 self.s['ct'],
+                                                 self.s['bri']))
 
 if __name__ == "__main__":
     # Testing
@@ -270,4 +317,7 @@ if __name__ == "__main__":
     display.print('Init deCONZ', (4,1)) 
     deconz = Deconz()
 
-    LightsMenu(deconz.lights, keypad, display).run()
\ No newline at end of file
+    async def test():
+        asyncio.create_task(display.run())
+        await LightsMenu(deconz.lights, keypad, display).run()
+    asyncio.run(test())
\ No newline at end of file
@@ -1,59 +1,123 @@
+import time
+import uasyncio as asyncio
 import system
+import dashboard
 from lights_menu import LightsMenu
 from hardware import Keypad, Display
 from deconz import Deconz
 from presets import PresetsActions
+from temperature import TempSensor
+from power import PowerManager
+
+
+boot_start = time.ticks_ms()
+
+
+def boot_report(stage, start, ok=True):
+    # Print how long a boot stage took and when it finished
+    now = time.ticks_ms()
+    print('Boot %-10s %6d ms %s (at %d ms)' % (stage, time.ticks_diff(now, start),
+                                             'ok' if ok else 'failed', time.ticks_diff(now, boot_start)))
+
+
+async def boot_stage(stage, aw):
+    # Await boot stage, report its time and whether it succeeded
+    start = time.ticks_ms()
+    try:
+        await aw
+        ok = True
+    except Exception as e:
+        print(stage, e)
+        ok = False
+    boot_report(stage, start, ok)
+    return ok
+
+
+async def blocking(*fs):
+    # Call blocking functions one by one, the UI gets to run before each of them
+    for f in fs:
+        await asyncio.sleep_ms(0)
+        f()
 
 
 display = Display()
 keypad = Keypad()
-dash = system.BS100_dashboard(display, keypad)
-dash.load_bar(2)
-
+dash = dashboard.BS100_dashboard(display, keypad, TempSensor())
 settings = system.Settings()
 dash.set_calendar_url(settings)
-dash.load_bar(2)
+dash.load_calendar()
+deconz = Deconz(connect=False)
+preset_actions = PresetsActions(keypad, deconz, display)
+power = PowerManager(dash, keypad, display)
+dash.draw_dash()
+boot_report('dashboard', boot_start)
+ip = False
 
-ip = system.start_wifi(display, settings, verbose=False)
-dash.load_bar(4)
 
-deconz = Deconz()
-dash.load_bar(5)
+async def network():
+    # Bring up network services in background, while the dashboard is already in use
+    global ip
+    start = time.ticks_ms()
+    ip = await system.connect_wifi(settings)
+    boot_report('wifi', start, ip)
+    if not ip:
+        return
+    asyncio.create_task(clock())
+    asyncio.create_task(lights())
+    asyncio.create_task(calendar())
 
-system.set_time(settings)
-dash.load_bar(2)
 
-dash.get_calendar()
-dash.load_bar(3)
+async def clock():
+    # RTC time is wrong after power loss, so keep trying with growing delay
+    delay = 10
+    while not await boot_stage('ntp', system.set_time(settings)):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 600)
+    dash.timers.reset('time') # Align minutes to the correct clock
+    dash.redraw('time')
 
-preset_actions = PresetsActions(keypad, deconz, display)
-dash.draw_dash()
 
-while True:
-    dash.update()
-    keypad.get_keys()
+async def lights():
+    while not await boot_stage('lights', blocking(deconz.get_lights, deconz.start_events)):
+        await asyncio.sleep(30)
+    asyncio.create_task(deconz.run())
+
+
+async def calendar():
+    if await boot_stage('calendar', blocking(dash.get_calendar)):
+        dash.redraw('calendar')
+
 
-    if keypad.any_pressed():
+async def main():
+    asyncio.create_task(display.run())
+    asyncio.create_task(dash.run())
+    asyncio.create_task(dash.render())
+    asyncio.create_task(dash.fetch())
+    asyncio.create_task(power.run())
+    asyncio.create_task(network())
+
+    while True:
+        await keypad.wait_keys()
         dash.backlight_on()
-        if preset_actions.key_pressed():
-            dash.draw_dash()
-            continue
+        dash.hide()
 
-    if keypad.p_kzprava:
-        preset_actions.menu().run()
+        if await preset_actions.key_pressed():
+            pass
+        elif keypad.p_kzprava:
+            await preset_actions.menu().run()
+        elif keypad.p_potvrz:
+            display.clear()
+            display.print('Loading...', (5,1))
+            display.flush()
+            deconz.refresh()
+            await LightsMenu(deconz.lights, keypad, display, True).run()
+        elif keypad.p_zero:
+            await system.ServiceMenu(ip or 'offline', settings, display, keypad, deconz, preset_actions).run()
+            preset_actions.load()
+        else:
+            dash.show()
+            continue
         dash.draw_dash()
-        continue
 
-    if keypad.p_potvrz:
-        display.clear()
-        display.print('Loading...', (5,1))
-        deconz.get_lights()
-        LightsMenu(deconz.lights, keypad, display, True).run()
-        dash.draw_dash()
-        continue
 
-    if keypad.p_zero:
-        system.ServiceMenu(ip, settings, display, keypad, deconz, preset_actions).run()
-        preset_actions.load()
-        dash.draw_dash()
-        continue
+asyncio.run(main())
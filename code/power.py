@@ -0,0 +1,78 @@
+import time
+import machine
+import network
+import esp32
+import uasyncio as asyncio
+
+
+class PowerManager():
+    """ Saves power while the backlight is off
+
+    Lowers CPU clock, lets Wi-Fi modem sleep between beacons and light sleeps
+    until the next dashboard timer. A key press wakes the ESP32 up, the key
+    drive lines are held high while sleeping so any key pulls its input high. """
+    def __init__(self, dash, keypad, display, idle_freq=80000000, max_sleep=10000, sleep=True):
+        self.dash = dash
+        self.keypad = keypad
+        self.display = display
+        self.full_freq = machine.freq()
+        self.idle_freq = idle_freq
+        self.max_sleep = max_sleep # ms, limits how long network traffic waits
+        self.sleep = sleep
+        self.idle = False
+        self._wlan = network.WLAN(network.STA_IF)
+        self._pm = None # Wi-Fi power management before going idle
+        self._hold = time.ticks_ms() # Don't go idle before, gives time to handle the waking key
+        # Duty cycle of the last idle period
+        self._idle_start = 0
+        self._slept = 0
+        esp32.wake_on_ext1(pins=(keypad.k_1, keypad.k_2, keypad.k_3, keypad.k_4,
+                                 keypad.k_5, keypad.k_6, keypad.k_7, keypad.k_8),
+                           level=esp32.WAKEUP_ANY_HIGH)
+
+    async def run(self, period=100):
+        """ Go idle once the backlight turns off, sleep whenever nothing has to run """
+        while True:
+            await asyncio.sleep_ms(period)
+            if self.dash.backlight or time.ticks_diff(self._hold, time.ticks_ms()) > 0:
+                if self.idle:
+                    self.wake()
+                continue
+            if not self.idle:
+                self.go_idle()
+            if self.sleep and not self.display.dirty and not self.dash.busy():
+                self.light_sleep(min(self.dash.next_timer(), self.max_sleep))
+
+    def go_idle(self):
+        self.idle = True
+        self._idle_start = time.ticks_ms()
+        self._slept = 0
+        machine.freq(self.idle_freq)
+        try:
+            self._pm = self._wlan.config('pm')
+            self._wlan.config(pm=self._wlan.PM_POWERSAVE)
+        except (AttributeError, ValueError): # Firmware without Wi-Fi power management
+            self._pm = None
+
+    def wake(self):
+        """ Full speed again, reports duty cycle of the idle period """
+        self.idle = False
+        machine.freq(self.full_freq)
+        if self._pm is not None:
+            self._wlan.config(pm=self._pm)
+        total = time.ticks_diff(time.ticks_ms(), self._idle_start)
+        if total > 0:
+            print('Idle %d s, awake %d%%' % (total // 1000, 100 * (total - self._slept) // total))
+
+    def light_sleep(self, ms):
+        if ms < 50:
+            return
+        self.keypad.suspend()
+        t = time.ticks_ms()
+        machine.lightsleep(ms)
+        self._slept += time.ticks_diff(time.ticks_ms(), t)
+        self.keypad.resume()
+        if machine.wake_reason() == machine.EXT1_WAKE:
+            # Key press, full clock right away, keypad scan picks up the key
+            self._hold = time.ticks_add(time.ticks_ms(), 1000)
+            self.wake()
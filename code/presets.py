@@ -1,5 +1,6 @@
 import ujson
 import time
+import uasyncio as asyncio
 from ucollections import OrderedDict
 from base_menu import BaseMenu
 from lights_menu import LightsMenu, ColorMenu
@@ -14,66 +15,123 @@ class PresetsActions():
         self.load()
 
     def load(self):
-        """ Load presets """
+        """ Load presets and their deCONZ scenes """
         with open('presets.json', 'r') as po:
             self.presets = ujson.load(po)
-
-    def save(self):
-        """ Save presets """
+        try:
+            with open('scenes.json', 'r') as so:
+                self.scenes = ujson.load(so)
+        except OSError: # No scenes synced yet
+            self.scenes = {}
+
+    def save(self, preset_id):
+        """ Save presets, the changed preset is synced to its deCONZ scene in background """
         with open('presets.json', 'w') as po: # Save presets
             ujson.dump(self.presets, po)
-
-    def key_pressed(self):
+        # Until the sync is done the preset is replayed light by light. The
+        # old scene is dropped from scenes.json too, so load() doesn't bring
+        # it back and it stays dropped if the sync fails.
+        ids = self.scenes.pop(preset_id, None)
+        self.save_scenes()
+        asyncio.create_task(self.sync_scene(preset_id, ids))
+
+    def save_scenes(self):
+        """ Store mapping of presets to (group id, scene id) in scenes.json """
+        with open('scenes.json', 'w') as so:
+            ujson.dump(self.scenes, so)
+
+    async def sync_scene(self, preset_id, ids=None):
+        """ Create or update group + scene in deCONZ for the preset
+
+        ids: (group id, scene id) from previous sync """
+        preset = self.presets.get(preset_id)
+        if not preset or not preset[1]:
+            return
+        ids = await self.deconz.sync_scene(f'BS100 preset {preset_id}', preset[1], ids)
+        if ids:
+            self.scenes[preset_id] = ids
+            self.save_scenes()
+
+    async def key_pressed(self):
         """ Handle key press """
         if self.keypad.p_red: # If RED button is pressed wait 5 sec for another key
-            tout = time.time() + 5
-            while tout > time.time():
-                self.keypad.get_keys()
-                if self._preset_keys(True):
+            tout = time.ticks_add(time.ticks_ms(), 5000)
+            while True:
+                left = time.ticks_diff(tout, time.ticks_ms())
+                if left <= 0 or not await self.keypad.wait_keys(left):
+                    break
+                if await self._preset_keys(True):
                     return True
 
-        return self._preset_keys(False)
+        return await self._preset_keys(False)
 
-    def _preset_keys(self, off):
+    async def _preset_keys(self, off):
         """ Check keys assigned to presets """
         if self.keypad.p_one:
-            self.do_preset('1', off)
+            await self.do_preset('1', off)
         elif self.keypad.p_two:
-            self.do_preset('2', off)
+            await self.do_preset('2', off)
         elif self.keypad.p_three:
-            self.do_preset('3', off)
+            await self.do_preset('3', off)
         elif self.keypad.p_four:
-            self.do_preset('4', off)
+            await self.do_preset('4', off)
         elif self.keypad.p_five:
-            self.do_preset('5', off)
+            await self.do_preset('5', off)
         elif self.keypad.p_six:
-            self.do_preset('6', off)
+            await self.do_preset('6', off)
         elif self.keypad.p_seven:
-            self.do_preset('7', off)
+            await self.do_preset('7', off)
         elif self.keypad.p_eight:
-            self.do_preset('8', off)
+            await self.do_preset('8', off)
         elif self.keypad.p_nine:
-            self.do_preset('9', off)
+            await self.do_preset('9', off)
         else:
             return False # Return False if not preset key was pressed
         return True
 
-    def do_preset(self, preset, off):
+    async def do_preset(self, preset, off):
         """ Send preset state to all lights in preset """
         self.display.clear()      
         self.display.print('Applying...', (5,1))
+        self.display.flush()
 
+        states = []
         for light_id, state in self.presets[preset][1].items():
-            if off: # If 'off' is True, turn off all lights in preset
-                self.deconz.get_light_by_id(light_id).off()
-                continue
             l = self.deconz.get_light_by_id(light_id)
-            if state['mode'] == 'color':
-                l.set_color(state['on'], state['hue'], state['sat'], state['bri'])
+            if l is None: # Light was removed from deCONZ
+                continue
+            if off: # If 'off' is True, turn off all lights in preset
+                states.append((l, l.off_state()))
+            elif state['mode'] == 'color':
+                states.append((l, l.color_state(state['on'], state['hue'], state['sat'], state['bri'])))
             elif state['mode'] == 'ctemp':
-                l.set_ctemp(state['on'], state['ct'], state['bri'])
+                states.append((l, l.ctemp_state(state['on'], state['ct'], state['bri'])))
             else:
-                l._set_remote_state(state)
+                states.append((l, state))
+
+        # Change all lights at once using deCONZ scene, fall back to
+        # setting each light if the scene is missing
+        ids = self.scenes.get(preset)
+        if ids:
+            if off:
+                status = self.deconz.group_action(ids[0], {'on': False})
+            else:
+                status = self.deconz.recall_scene(ids[0], ids[1])
+            if status == 200:
+                return
+            print('scene', preset, status)
+
+        failed = await self.deconz.set_states(states, self._progress)
+        if failed:
+            self.display.clear()
+            self.display.print(f'Failed {len(failed)}/{len(states)}', (0,0))
+            for y, l in enumerate(failed[0:3]):
+                self.display.print(l.name[0:20], (0,y+1))
+            await asyncio.sleep(2)
+
+    def _progress(self, done, total):
+        """ Show progress of applying preset """
+        self.display.print(f'{done}/{total}', (8,2))
 
     def configure(self):
         """ Presets configuration menu """
@@ -95,22 +153,22 @@ class PresetsListMenu(BaseMenu):
 
         super().__init__(display, keypad, items)
 
-    def run(self):
-        if self.empty_menu(): return
+    async def run(self):
+        if await self.empty_menu(): return
 
         self.draw()
         while True:
-            self.keypad.get_keys()
+            await self.keypad.wait_keys()
 
             if self.keypad.p_zrusit:
                 return
             if self.keypad.p_potvrz:
                 selected_item = self.strings[self.selected]
-                self.presets_cls.do_preset(self.items[selected_item], False)
+                await self.presets_cls.do_preset(self.items[selected_item], False)
                 return
             if self.keypad.p_red:
                 selected_item = self.strings[self.selected]
-                self.presets_cls.do_preset(self.items[selected_item], True)
+                await self.presets_cls.do_preset(self.items[selected_item], True)
                 return
             if self.keypad.p_up:
                 self.selected -= 1
@@ -135,12 +193,12 @@ class PresetsListConfigMenu(BaseMenu):
 
         super().__init__(display, keypad, items)
 
-    def run(self):
-        if self.empty_menu(): return
+    async def run(self):
+        if await self.empty_menu(): return
 
         self.draw()
         while True:
-            self.keypad.get_keys()
+            await self.keypad.wait_keys()
             
             if self.keypad.p_zrusit:
                 return False
@@ -148,13 +206,13 @@ class PresetsListConfigMenu(BaseMenu):
                 selected_item = self.strings[self.selected]
                 preset_id = selected_item.split(':')[0]
                 preset_name = self.presets_cls.presets[preset_id][0]
-                new_preset = self.items[selected_item].run() # Run preset menu
+                new_preset = await self.items[selected_item].run() # Run preset menu
                 # if preset was changed
                 if new_preset:
-                    new_name = text_input_ui(self.display, self.keypad, 'Name', preset_name)
+                    new_name = await text_input_ui(self.display, self.keypad, 'Name', preset_name)
                     preset_name = new_name if new_name else preset_name
                     self.presets_cls.presets[preset_id] = [preset_name, new_preset]
-                    self.presets_cls.save()
+                    self.presets_cls.save(preset_id)
                     return True
                 self.draw()
             if self.keypad.p_up:
@@ -178,6 +236,8 @@ class PresetConfigMenu(BaseMenu):
         # Get lights used in preset
         for light_id in preset.keys():
             light = deconz.get_light_by_id(light_id)
+            if light is None: # Light was removed from deCONZ
+                continue
             items[light.name] = light
 
         # Get list of lights not in preset
@@ -192,12 +252,12 @@ class PresetConfigMenu(BaseMenu):
 
         super().__init__(display, keypad, items)
 
-    def run(self):
-        if self.empty_menu(): return
+    async def run(self):
+        if await self.empty_menu(): return
 
         self.draw()
         while True:
-            self.keypad.get_keys()
+            await self.keypad.wait_keys()
             
             if self.keypad.p_zrusit:
                 return
@@ -211,19 +271,20 @@ class PresetConfigMenu(BaseMenu):
                 if item_name == '[ ADD ]':
                     self.display.clear()
                     self.display.print('Loading...', (5,1))
-                    self.deconz.get_lights()
-                    l = LightsMenu(self.unused_lights, self.keypad, self.display, return_light=True).run()
+                    self.display.flush()
+                    self.deconz.refresh()
+                    l = await LightsMenu(self.unused_lights, self.keypad, self.display, return_light=True).run()
                     if l:
-                        self.preset[l.id] = l.state
+                        self.preset[l.id] = l.state.to_dict()
                     # If new light was addedd re-init the menu
                     self.__init__(self.keypad, self.display, self.preset, self.deconz)
                     self.draw()
                     continue
 
                 # Change light settings in preset
-                l = ColorMenu(self.items[item_name], self.display, self.keypad).run()
+                l = await ColorMenu(self.items[item_name], self.display, self.keypad).run()
                 if l:
-                    self.preset[l.id] = l.state
+                    self.preset[l.id] = l.state.to_dict()
                 self.draw()
 
             if self.keypad.p_red:
@@ -263,4 +324,8 @@ if __name__ == "__main__":
     display.print('Init deCONZ', (4,1)) 
     deconz = Deconz()
     presets = PresetsActions(keypad, deconz, display)
-    presets.menu()
\ No newline at end of file
+
+    async def test():
+        asyncio.create_task(display.run())
+        await presets.menu().run()
+    asyncio.run(test())
\ No newline at end of file
@@ -2,27 +2,155 @@
 # Credit: SpotlightKid on GitHub
 import usocket
 
+ssl_context = None # Used where the ssl module supports sessions, default context if None
+_sessions = {} # Last TLS session with each host
+
+
+def wrap_tls(s, host):
+    """Start TLS, resuming the last session with host where the ssl module supports it"""
+    try:
+        import ssl
+    except ImportError:
+        import ussl as ssl
+    if not hasattr(ssl, "SSLSession"):
+        # No session resumption (MicroPython), full handshake every time
+        return ssl.wrap_socket(s, server_hostname=host)
+    global ssl_context
+    if ssl_context is None:
+        ssl_context = ssl.create_default_context()
+    return ssl_context.wrap_socket(s, server_hostname=host, session=_sessions.get(host))
+
+
+def save_session(host, s):
+    """Keep TLS session of a finished connection for the next wrap_tls with host"""
+    session = getattr(s, "session", None)
+    if session is not None:
+        _sessions[host] = session
+
+
 class Response:
 
-    def __init__(self, f):
+    def __init__(self, f, length=None, chunked=False, tls_host=None):
         self.raw = f
+        self._tls_host = tls_host
         self.encoding = "utf-8"
         self._cached = None
+        self._left = length # Bytes left in the body or current chunk, None until the connection closes
+        self._chunked = chunked
+        self._chunk_end = False # CRLF after chunk data wasn't read yet
 
     def close(self):
         if self.raw:
-            self.raw.close()
-            self.raw = None
+            self._close_raw()
         self._cached = None
 
+    def _close_raw(self):
+        # TLS session is complete (TLS 1.3 tickets come after the handshake) once the response is read
+        if self._tls_host:
+            save_session(self._tls_host, self.raw)
+        self.raw.close()
+        self.raw = None
+
+    def readinto(self, buf):
+        """Read next part of the body into buf, returns number of bytes, 0 at the end"""
+        if self.raw is None:
+            return 0
+        if self._chunked and not self._left:
+            if self._chunk_end:
+                self.raw.readline()
+            l = self.raw.readline()
+            self._left = int(l.split(b";", 1)[0], 16) if l.strip() else 0
+            self._chunk_end = True
+            if self._left == 0:
+                # Last chunk, skip trailers
+                while True:
+                    l = self.raw.readline()
+                    if not l or l == b"\r\n":
+                        break
+                self._chunked = False
+        if self._left == 0:
+            return 0
+        mv = memoryview(buf)
+        if self._left is not None and self._left < len(buf):
+            mv = mv[:self._left]
+        n = self.raw.readinto(mv) or 0
+        if self._left is not None:
+            if n == 0:
+                raise OSError("Connection closed")
+            self._left -= n
+        return n
+
+    def iter_content(self, chunk_size=256):
+        """Yield the body in parts
+
+        Parts are memoryviews of one buffer, valid until the next part."""
+        buf = bytearray(chunk_size)
+        mv = memoryview(buf)
+        try:
+            while True:
+                n = self.readinto(buf)
+                if not n:
+                    break
+                yield mv[:n]
+        finally:
+            self.close()
+
+    def iter_lines(self, chunk_size=256):
+        """Yield lines of the body without line endings
+
+        Lines are memoryviews of one buffer, valid until the next line.
+        Lines longer than chunk_size are split."""
+        buf = bytearray(chunk_size)
+        mv = memoryview(buf)
+        start = end = 0
+        try:
+            while True:
+                i = start
+                while i < end and buf[i] != 10:
+                    i += 1
+                if i < end:
+                    yield mv[start:i-1 if i > start and buf[i-1] == 13 else i]
+                    start = i + 1
+                    continue
+                if start == 0 and end == chunk_size:
+                    yield mv[:end]
+                    end = 0
+                    continue
+                # Move the incomplete line to the start and read more
+                for j in range(end - start):
+                    buf[j] = buf[start + j]
+                end -= start
+                start = 0
+                n = self.readinto(mv[end:])
+                if not n:
+                    if end:
+                        yield mv[:end]
+                    break
+                end += n
+        finally:
+            self.close()
+
     @property
     def content(self):
         if self._cached is None:
             try:
-                self._cached = self.raw.read()
+                if self._left is not None and not self._chunked:
+                    buf = bytearray(self._left)
+                    mv = memoryview(buf)
+                    pos = 0
+                    while pos < len(buf):
+                        n = self.readinto(mv[pos:])
+                        if not n: # Response was closed
+                            raise OSError("Connection closed")
+                        pos += n
+                else:
+                    buf = bytearray()
+                    for part in self.iter_content():
+                        buf.extend(part)
+                self._cached = bytes(buf)
             finally:
-                self.raw.close()
-                self.raw = None
+                if self.raw:
+                    self._close_raw()
         return self._cached
 
     @property
@@ -50,7 +178,6 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
         if proto == "http:":
             port = 80
         elif proto == "https:":
-            import ussl
             port = 443
         else:
             raise ValueError("Unsupported protocol: " + proto)
@@ -70,8 +197,8 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
         try:
             s.connect(ai[-1])
             if proto == "https:":
-                s = ussl.wrap_socket(s, server_hostname=host)
-            s.write(b"%s /%s HTTP/1.0\r\n" % (method, path))
+                s = wrap_tls(s, host)
+            s.write(b"%s /%s HTTP/1.1\r\n" % (method, path))
             if not "Host" in headers:
                 s.write(b"Host: %s\r\n" % host)
             # Iterate over keys to avoid tuple alloc
@@ -95,16 +222,20 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
             reason = ""
             if len(l) > 2:
                 reason = l[2].rstrip()
+            length = None
+            chunked = False
             while True:
                 l = s.readline()
                 if not l or l == b"\r\n":
                     break
                 #print(l)
 
-                if l.startswith(b"Transfer-Encoding:"):
-                    if b"chunked" in l:
-                        raise ValueError("Unsupported " + l.decode())
-                elif l.startswith(b"Location:") and 300 <= status <= 399:
+                h = l.lower()
+                if h.startswith(b"transfer-encoding:"):
+                    chunked = b"chunked" in h
+                elif h.startswith(b"content-length:"):
+                    length = int(l[15:])
+                elif h.startswith(b"location:") and 300 <= status <= 399:
                     if not redir_cnt:
                         raise ValueError("Too many redirects")
                     redir_cnt -= 1
@@ -120,7 +251,7 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
                     l = l.decode()
                     k, v = l.split(":", 1)
                     resp_d[k] = v.strip()
-                elif callable(pass_headers):
+                elif callable(parse_headers):
                     parse_headers(l, resp_d)
         except OSError:
             s.close()
@@ -129,7 +260,10 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
         if status != 300:
             break
 
-    resp = Response(s)
+    if method == "HEAD" or status in (204, 304):
+        length = 0
+        chunked = False
+    resp = Response(s, None if chunked else length, chunked, host if proto == "https:" else None)
     resp.status_code = status
     resp.reason = reason
     if resp_d is not None:
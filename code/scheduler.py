@@ -0,0 +1,99 @@
+import time
+
+
+class Job():
+    def __init__(self, name, callback, period, align, repeat):
+        self.name = name
+        self.callback = callback
+        self.period = period # ms
+        self.align = align # Run at wall clock multiples of period
+        self.repeat = repeat
+        self.deadline = 0 # ticks_ms
+        self.gen = 0 # Heap entries of older generations are stale
+
+
+class Scheduler():
+    """ Timers ordered by deadline in a binary heap
+
+    Deadlines are ticks_ms values compared with ticks_diff, so they keep
+    working when ticks wrap around. Aligned jobs are scheduled from the wall
+    clock (e.g. on every minute), so they don't drift and follow clock changes. """
+    def __init__(self):
+        self.jobs = {}
+        self._heap = [] # [deadline, gen, job]
+
+    def add(self, name, callback, period, align=False, repeat=True):
+        """ Register job called every period ms, or once after period ms if not repeat """
+        job = Job(name, callback, period, align, repeat)
+        self.jobs[name] = job
+        self._schedule(job)
+        return job
+
+    def reset(self, name):
+        """ Start period of the job again from now, also re-arms a job that already ran """
+        self._schedule(self.jobs[name])
+
+    def cancel(self, name):
+        self.jobs.pop(name).gen += 1
+
+    def next_deadline(self):
+        """ Milliseconds until the nearest job, None if there is none """
+        heap = self._heap
+        while heap and heap[0][1] != heap[0][2].gen:
+            self._pop()
+        if not heap:
+            return None
+        return max(time.ticks_diff(heap[0][0], time.ticks_ms()), 0)
+
+    def run(self):
+        """ Call all jobs whose deadline has passed """
+        while self.next_deadline() == 0:
+            job = self._pop()[2]
+            if job.repeat:
+                self._schedule(job)
+            else:
+                job.gen += 1
+            job.callback()
+
+    def _schedule(self, job):
+        now = time.ticks_ms()
+        if job.align:
+            # time.time() has only second resolution
+            left = job.period - time.time_ns() // 1000000 % job.period
+        else:
+            left = job.period
+        job.deadline = time.ticks_add(now, left)
+        job.gen += 1
+        self._push([job.deadline, job.gen, job])
+
+    def _push(self, entry):
+        heap = self._heap
+        heap.append(entry)
+        i = len(heap) - 1
+        while i:
+            parent = (i - 1) // 2
+            if time.ticks_diff(heap[parent][0], entry[0]) <= 0:
+                break
+            heap[i] = heap[parent]
+            i = parent
+        heap[i] = entry
+
+    def _pop(self):
+        heap = self._heap
+        top = heap[0]
+        last = heap.pop()
+        n = len(heap)
+        if n:
+            i = 0
+            while True:
+                child = 2 * i + 1
+                if child >= n:
+                    break
+                if child + 1 < n and time.ticks_diff(heap[child + 1][0], heap[child][0]) < 0:
+                    child += 1
+                if time.ticks_diff(last[0], heap[child][0]) <= 0:
+                    break
+                heap[i] = heap[child]
+                i = child
+            heap[i] = last
+        return top
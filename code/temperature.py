@@ -3,18 +3,63 @@ import time
 import ds18x20
 from machine import Pin
 
+# Configuration register and conversion time (ms) for each resolution
+RESOLUTION = {9: (0x1f, 94), 10: (0x3f, 188), 11: (0x5f, 375), 12: (0x7f, 750)}
+
 
 class TempSensor():
-    def __init__(self):
-        self.ds = ds18x20.DS18X20(onewire.OneWire(Pin(4)))
-        self.device = self.ds.scan()[0]
-        self.ds.convert_temp()
-        time.sleep_ms(750)
+    """ DS18B20 sampled without waiting for the conversion
+
+    Each read collects the conversion started by the previous one once its
+    conversion time has passed, and starts the next one. The sensor is looked
+    for on the first read and again whenever it stops responding. """
+    def __init__(self, pin=4, resolution=12):
+        self.ds = ds18x20.DS18X20(onewire.OneWire(Pin(pin)))
+        self.resolution = resolution
+        self.config, self.conv_ms = RESOLUTION[resolution]
+        self.device = None
+        self.temp = None # Last valid temperature
+        self._ready = None # ticks_ms when the running conversion is done
 
     def read(self):
-        """ Read the temp senced last time this function was called
-        
-        There has to be at least 750ms between reads """
-        temp = self.ds.read_temp(self.device)
+        """ Return last temperature as text, '----' if the sensor isn't available """
+        try:
+            self._sample()
+        except onewire.OneWireError as e: # No presence pulse, sensor lost
+            print('TempSensor', e)
+            self.device = None
+            self.temp = None
+            self._ready = None
+        return '----' if self.temp is None else str(self.temp)[0:4]
+
+    def _sample(self):
+        if self.device is None:
+            devices = self.ds.scan()
+            if not devices:
+                self.temp = None
+                return
+            self.device = devices[0]
+            self.ds.write_scratch(self.device, bytearray((0, 0, self.config))) # TH, TL, config
+        if self._ready is not None:
+            if time.ticks_diff(time.ticks_ms(), self._ready) < 0:
+                return # Still converting
+            self._ready = None
+            try:
+                buf = self.ds.read_scratch(self.device)
+            except onewire.OneWireError:
+                raise
+            except Exception as e: # CRC error, keep the last value
+                print('TempSensor', e)
+            else:
+                t = buf[0] | buf[1] << 8
+                if t & 0x8000:
+                    t -= 0x10000
+                # Low bits are undefined at lower resolutions
+                t &= ~((1 << (12 - self.resolution)) - 1)
+                if t == 0x550:
+                    # 85 C is the power-on value, sensor was reset and lost its configuration
+                    self.device = None
+                    return
+                self.temp = t / 16
         self.ds.convert_temp()
-        return str(temp)[0:4]
+        self._ready = time.ticks_add(time.ticks_ms(), self.conv_ms)